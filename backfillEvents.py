@@ -0,0 +1,46 @@
+#!/usr/bin/python
+"""add eventKind/localHour (see history_queries.eventFields), and
+searchText for structured input (see Bot._mongoDoc), to docs saved before
+those fields existed."""
+import logging
+
+from pymongo import UpdateOne
+
+from configsnapshot import loadConfig
+from history_queries import eventFields
+from storage import configureMongo, diaryDb
+from structuredinput import englishInput, kvFromMongoList
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger()
+
+batchSize = 500
+
+config = loadConfig()
+configureMongo(config.mongo)
+db = diaryDb()
+for botName in db.list_collection_names():
+    if '.' in botName or botName.startswith('system'):
+        continue
+    coll = db[botName]
+    updates = []
+    done = 0
+    for row in coll.find({'$or': [
+            {'localHour': {'$exists': False}},
+            {'structuredInput': {'$exists': True},
+             'searchText': {'$in': [None, '']}},
+    ]}, projection=['dc:created', 'sioc:content', 'structuredInput']):
+        if 'dc:created' not in row:
+            log.warning('%s %s: no dc:created', botName, row['_id'])
+            continue
+        fields = eventFields(row)
+        if 'structuredInput' in row:
+            fields['searchText'] = englishInput(
+                config.conversions, kvFromMongoList(row['structuredInput']))
+        updates.append(UpdateOne({'_id': row['_id']}, {'$set': fields}))
+        if len(updates) >= batchSize:
+            done += coll.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        done += coll.bulk_write(updates, ordered=False).modified_count
+    log.info('%s: backfilled %s docs', botName, done)
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+"""load test the whole app: seeded bots in a scratch database on a local
+mongo, chat through a stand-in for slack, and real HTTP to the cyclone app.
+Reports throughput and p50/p99 latency per request kind. Run it with
+$DIARYBOT_MONGO_HOST pointing at a mongo you don't mind writing to. It
+drops everything in $DIARYBOT_MONGO_DB, so that has to end in _bench.
+
+The stand-in replaces ChatInterface rather than slack's servers, since
+slack-sansio's methods are absolute slack.com urls. Incoming chat messages
+go to IncomingChatHandler.onMsg the way RTM messages do, and replies take
+--slack-latency to 'send'.
+"""
+import os
+
+# these are read at import time
+os.environ.setdefault('DIARYBOT_MONGO_HOST', 'localhost')
+os.environ.setdefault('DIARYBOT_MONGO_DB', 'diarybot_bench')
+os.environ.setdefault('DIARYBOT_JOURNAL', '/tmp/diarybot-bench-journal.ndjson')
+os.environ.setdefault('DIARYBOT_LOGIN_BAR', '')
+os.environ.setdefault('DIARYBOT_AGENT', 'http://example.com/benchUser')
+
+import sys
+
+if not os.environ['DIARYBOT_MONGO_DB'].endswith('_bench'):
+    sys.exit(f'refusing to wipe mongo db {os.environ["DIARYBOT_MONGO_DB"]!r}; '
+             f'set DIARYBOT_MONGO_DB to a name ending in _bench')
+
+# before anything imports twisted's default reactor
+import reactorsetup
+
+import datetime
+import time
+import urllib.parse
+from typing import Callable, Dict, List
+
+import docopt
+from bson import ObjectId
+from dateutil import tz
+from rdflib import RDF, RDFS, Graph, Literal, Namespace, URIRef
+from twisted.internet import defer, reactor
+from twisted.internet.defer import Deferred, ensureDeferred
+from twisted.internet.task import deferLater
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+
+from diarybot2 import IncomingChatHandler, _pageCache, makeApp
+from configsnapshot import Config, compileConfig
+from bot import makeBots
+import rollups
+from history_queries import eventFields
+from storage import configureMongo, diaryDb
+
+DB = Namespace('http://bigasterisk.com/ns/diaryBot#')
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+BENCH = Namespace('http://example.com/bench/')
+user = URIRef(os.environ['DIARYBOT_AGENT'])
+port = 9049
+
+words = ['1 carb', '1 carb ER', 'on', 'off', 'sleepy', 'bed', 'lunch']
+
+
+class FakeChat:
+    """the ChatInterface API, with no slack behind it"""
+    def __init__(self, onMsg: Callable, latency: float):
+        self.onMsg = onMsg
+        self.latency = latency
+        self.sent = 0
+
+    def initBot(self, bot, token: str) -> Deferred:
+        return defer.succeed(None)
+
+    def removeBot(self, bot) -> None:
+        pass
+
+    def sendMsg(self, bot, toUser: URIRef, msg: str) -> Deferred:
+        self.sent += 1
+        return deferLater(reactor, self.latency, lambda: None)
+
+    async def userIsOnline(self, user: URIRef):
+        return True
+
+    def receive(self, bot, fromUser: URIRef, msg: str) -> Deferred:
+        """as if fromUser typed msg to bot"""
+        return self.onMsg(bot, fromUser, msg)
+
+
+def configGraph(numBots: int) -> Graph:
+    g = Graph()
+    for i in range(numBots):
+        b = BENCH['bot%d' % i]
+        g.add((b, RDF.type, DB['DiaryBot']))
+        g.add((b, RDFS.label, Literal('benchbot%d' % i)))
+        g.add((b, DB['owner'], user))
+        g.add((b, DB['slackBotUserOauth'], Literal('xoxb-bench')))
+    g.add((user, FOAF['name'], Literal('bench user')))
+    return g
+
+
+def seed(numBots: int, numDocs: int) -> None:
+    """numDocs per bot, every 37 minutes up to now, like _save would
+    write them"""
+    if os.path.exists(os.environ['DIARYBOT_JOURNAL']):
+        os.remove(os.environ['DIARYBOT_JOURNAL'])  # from an earlier run
+    db = diaryDb()
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    end = datetime.datetime.now(tz.tzlocal())
+    for i in range(numBots):
+        coll = db['benchbot%d' % i]
+        docs = []
+        for n in range(numDocs):
+            created = end - datetime.timedelta(minutes=37 * (numDocs - n))
+            doc = {
+                '_id': ObjectId(),
+                'dc:created': created.isoformat(),
+                'dc:creator': user,
+                'created': created.astimezone(tz.tzutc()),
+                'sioc:content': words[n % len(words)],
+            }
+            doc.update(eventFields(doc))
+            docs.append(doc)
+        if docs:
+            coll.insert_many(docs)
+        rollups.rebuildAll(coll)
+
+
+def percentile(sortedTimes: List[float], p: float) -> float:
+    return sortedTimes[min(len(sortedTimes) - 1,
+                           int(p / 100 * len(sortedTimes)))]
+
+
+async def measure(label: str, call: Callable[[int], Deferred], count: int,
+                  concurrency: int) -> None:
+    times: List[float] = []
+    nextCall = iter(range(count))
+
+    async def worker():
+        for i in nextCall:
+            t1 = time.time()
+            await call(i)
+            times.append(time.time() - t1)
+
+    t1 = time.time()
+    await defer.gatherResults(
+        [ensureDeferred(worker()) for _ in range(concurrency)],
+        consumeErrors=True)
+    dt = time.time() - t1
+    times.sort()
+    print(f'{label:<22} {count / dt:8.1f} req/s   '
+          f'p50 {percentile(times, 50) * 1000:7.1f} ms   '
+          f'p99 {percentile(times, 99) * 1000:7.1f} ms')
+
+
+async def run(arg: Dict, bots: Dict, chat: FakeChat) -> None:
+    agent = Agent(reactor, pool=HTTPConnectionPool(reactor, persistent=True))
+    botNames = sorted(bots)
+    count = int(arg['--requests'])
+    concurrency = int(arg['--concurrency'])
+
+    def botFor(i: int):
+        return bots[botNames[i % len(botNames)]]
+
+    async def fetch(method: bytes, path: str, expect=(200, 302)):
+        resp = await agent.request(method,
+                                   ('http://localhost:%d%s' %
+                                    (port, path)).encode('utf8'))
+        await readBody(resp)
+        if resp.code not in expect:
+            raise ValueError(f'{method} {path} returned {resp.code}')
+
+    def get(path: str) -> Callable[[int], Deferred]:
+        return lambda i: ensureDeferred(
+            fetch(b'GET', path.replace('BOT', botFor(i).name)))
+
+    def httpSave(i: int) -> Deferred:
+        return ensureDeferred(
+            fetch(
+                b'POST', '/%s/message?%s' % (botFor(i).name,
+                                             urllib.parse.urlencode(
+                                                 {'msg': 'http %d' % i}))))
+
+    def chatSave(i: int) -> Deferred:
+        return chat.receive(botFor(i), user, 'chat %d' % i)
+
+    # a few refreshStatus/ensureIndexes calls are still starting up
+    await deferLater(reactor, .5, lambda: None)
+
+    await measure('save via chat', chatSave, count, concurrency)
+    await measure('save via http', httpSave, count, concurrency)
+    await measure('index', get('/'), count, concurrency)
+    for suffix in [
+            '', '/recent', '/latest', '/bedtimes', '/yearAgo', '/daily',
+            '/monthly', '/search?q=carb', '?format=ndjson', '?rcs=csv'
+    ]:
+        await measure('history' + suffix, get('/BOT/history' + suffix),
+                      count, concurrency)
+    print(f'{chat.sent} chat replies sent')
+
+
+def main():
+    arg = docopt.docopt("""
+    Usage: bench_e2e.py [options]
+
+    --bots=N              Bots to make [default: 2]
+    --history=N           Docs per bot [default: 5000]
+    --requests=N          Requests per kind [default: 200]
+    --concurrency=N       Requests in flight at once [default: 8]
+    --slack-latency=MS    Time for the slack stand-in to send [default: 50]
+    --no-page-cache       Render every page
+    --keep                Leave the scratch database afterwards
+    """)
+    numBots = int(arg['--bots'])
+    configureMongo()
+    seed(numBots, int(arg['--history']))
+    if arg['--no-page-cache']:
+        _pageCache.maxPages = 0
+
+    config = Config(compileConfig(configGraph(numBots)))
+    ich = IncomingChatHandler()
+    chat = FakeChat(ich.onMsg, int(arg['--slack-latency']) / 1000)
+    bots = makeBots(chat, config)
+    ich.lateInit(bots, chat)
+    reactor.listenTCP(port, makeApp(bots, config), interface='localhost')
+
+    def done(result):
+        if not arg['--keep']:
+            diaryDb().client.drop_database(diaryDb().name)
+        reactor.stop()
+        return result
+
+    reactor.callWhenRunning(lambda: ensureDeferred(run(arg, bots, chat)).
+                            addBoth(done).addErrback(print))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
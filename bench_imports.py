@@ -0,0 +1,50 @@
+#!/usr/bin/python
+"""time a fresh python importing each entry point, and say whether the
+slack stack came along."""
+import statistics
+import subprocess
+import sys
+import time
+
+runs = 5
+heavy = ['slack', 'aiohttp', 'twisted.internet.reactor']
+imports = [
+    'storage',
+    'configsnapshot',
+    'bot',
+    'nochat',
+    'diarybot2',
+    'chatinterface',
+]
+
+
+def timeImport(code: str) -> float:
+    times = []
+    for _ in range(runs):
+        t1 = time.time()
+        subprocess.check_call([sys.executable, '-c', code],
+                              stderr=subprocess.DEVNULL)
+        times.append(time.time() - t1)
+    return statistics.median(times)
+
+
+def main():
+    base = timeImport('pass')
+    print(f'python startup: {base * 1000:.0f} ms')
+    for mod in imports:
+        try:
+            dt = timeImport(f'import {mod}') - base
+        except subprocess.CalledProcessError:
+            print(f'import {mod:<15} failed')
+            continue
+        loaded = subprocess.check_output([
+            sys.executable, '-c',
+            f'import sys, {mod}; '
+            f'print(" ".join(m for m in {heavy!r} if m in sys.modules))'
+        ]).decode('utf8').strip()
+        print(f'import {mod:<15} {dt * 1000:6.0f} ms  also loads: '
+              f'{loaded or "-"}')
+
+
+if __name__ == '__main__':
+    main()
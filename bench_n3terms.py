@@ -0,0 +1,22 @@
+#!/usr/bin/python
+"""time decoding structuredInput pairs, as history and dose scans do."""
+import timeit
+
+from rdflib_term_parser import _parseN3TermSlow, parseN3Term
+
+pairs = [
+    ('<http://schema.org/drug>', '<http://bigasterisk.com/ns/diaryBot#carb>'),
+    ('<http://schema.org/doseValue>', '"1"^^<http://www.w3.org/2001/XMLSchema#integer>'),
+    ('<http://bigasterisk.com/ns/diaryBot#activity>', '<http://bigasterisk.com/ns/diaryBot#bed>'),
+    ('<http://www.w3.org/2000/01/rdf-schema#comment>', '"with food"@en'),
+]
+terms = [t for pair in pairs for t in pair]
+
+for t in terms:
+    assert parseN3Term(t) == _parseN3TermSlow(t), t
+
+number = 20000
+for name, f in [('uncached', _parseN3TermSlow), ('cached', parseN3Term)]:
+    secs = timeit.timeit(lambda: [f(t) for t in terms], number=number)
+    per = secs / (number * len(terms)) * 1e6
+    print(f'{name}: {per:.2f} usec per term')
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""time the history page's row rendering, the way history.get does it."""
+import datetime
+import itertools
+import time
+
+from bson import ObjectId
+from dateutil import tz
+from rdflib import Graph, URIRef
+
+# first, since it picks the reactor that bot.py goes on to import
+from diarybot2 import entryRow, loader, rowTemplateArgs
+import history_queries
+from bot import DEFAULT_HISTORY_COLUMNS, historyColumns
+from configsnapshot import Config, compileConfig
+
+numRows = 10000
+chunkRows = 100
+
+
+class FakeBot:
+    name = 'benchbot'
+    birthdate = datetime.datetime(2015, 1, 1, tzinfo=tz.tzutc())
+    config = Config(compileConfig(Graph()))
+    historyColumns = historyColumns(None, name)
+
+    def uriForDoc(self, d):
+        return URIRef('http://bigasterisk.com/diary/%s/%s' %
+                      (self.name, d['_id']))
+
+
+def fakeRows():
+    t = datetime.datetime(2020, 1, 1, tzinfo=tz.tzlocal())
+    words = ['1 carb', '1 carb ER', 'on', 'off', 'sleepy', 'bed', 'lunch']
+    for i in range(numRows):
+        created = t + datetime.timedelta(minutes=37 * i)
+        yield {
+            '_id': ObjectId(),
+            'dc:created': created.isoformat(),
+            'dc:creator': 'http://bigasterisk.com/foaf.rdf#drewp',
+            'created': created.astimezone(tz.tzutc()),
+            'sioc:content': words[i % len(words)],
+        }
+
+
+def main():
+    bot = FakeBot()
+    rows = list(fakeRows())
+    for query in [history_queries.All(), history_queries.Bedtimes()]:
+        d = rowTemplateArgs(bot, query, [], None)
+        rowsTemplate = loader.load('diaryviewrows.html')
+        out = 0
+        t1 = time.time()
+        entries = (entryRow(bot, row) for row in rows)
+        while True:
+            chunk = list(itertools.islice(entries, chunkRows))
+            if not chunk:
+                break
+            out += len(rowsTemplate.generate(entries=chunk, **d))
+        dt = time.time() - t1
+        print(f'{query.name}: {numRows} rows, {len(DEFAULT_HISTORY_COLUMNS)} '
+              f'columns in {dt:.3f}s ({numRows / dt:.0f} rows/s, '
+              f'{out} bytes)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,32 @@
 import datetime
 import logging
+import re
 import time
 
 from bson import ObjectId
 from dateutil import tz
 from dateutil.parser import parse
-from pymongo import MongoClient
-from rdflib import Namespace, RDFS, URIRef, Graph
+from pymongo.collection import Collection
+from rdflib import Namespace, URIRef
 from rdflib.term import Node
-from structuredinput import structuredInputElementConfig, kvFromMongoList, englishInput, mongoListFromKv
-from twisted.internet import reactor
-from twisted.internet.defer import ensureDeferred, Deferred
-from typing import Dict, Optional, Tuple, Set, List
-import requests
+from structuredinput import kvFromMongoList, englishInput, mongoListFromKv
+from twisted.internet.defer import (ensureDeferred, Deferred, DeferredList,
+                                    DeferredLock)
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Set, List, Pattern
 
-from chatinterface import ChatInterface
+from configsnapshot import Config
 from datestr import datestr
-from history_queries import OffsetTime
+from eventbus import EventBus
+from journal import Journal
+from metrics import STATS
+import rollups
+from outbox import Outbox, withTimeout
+from history_queries import OffsetTime, Query, eventFields, hourOfDay
+from storage import MongoStore, botCollection, configureMongo, uriForDoc
+
+if TYPE_CHECKING:
+    # not at runtime, since it brings in slack and aiohttp
+    from chatinterface import ChatInterface
 
 BOT = Namespace('http://bigasterisk.com/bot/')
 XS = Namespace('http://www.w3.org/2001/XMLSchema#')
@@ -26,88 +36,218 @@ DB = Namespace('http://bigasterisk.com/ns/diaryBot#')
 FOAF = Namespace('http://xmlns.com/foaf/0.1/')
 BIO = Namespace('http://vocab.org/bio/0.1/')
 SCHEMA = Namespace('http://schema.org/')
-INIT_NS = dict(sioc=SIOC, dc=DC, db=DB, foaf=FOAF, rdfs=RDFS.uri, bio=BIO)
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger('bot')
 
 
-def makeBots(chat, configGraph):
-    g = configGraph
-    bots: Dict[str, Bot] = {}
+# (label, regex) for the match columns of the history table, for bots
+# without a db:historyColumns list (see configsnapshot)
+DEFAULT_HISTORY_COLUMNS = [
+    ('carb', r'1 carb(?! ER)'),
+    ('carb ER', r'1 carb ER'),
+    ('on', r'^(on|sudden on)$'),
+    ('off', r'^off$'),
+    ('sleepy', r'^sleepy$'),
+]
 
-    for botNode, name, birthdate in g.query("""
-      SELECT DISTINCT ?botNode ?name ?birthdate WHERE {
-        ?botNode a db:DiaryBot;
-          rdfs:label ?name .
-        OPTIONAL {
-         ?botNode bio:event [ a bio:Birth; bio:date ?birthdate ] .
-        }
-      }""",
-                                            initNs=INIT_NS):
-        if birthdate is not None:
-            birthdate = parse(birthdate).replace(tzinfo=tz.gettz('UTC'))
 
+def historyColumns(specs: Optional[List[Tuple[str, str]]],
+                   botName: str) -> List[Tuple[str, Pattern]]:
+    out = []
+    for label, pat in (specs or DEFAULT_HISTORY_COLUMNS):
+        try:
+            out.append((label, re.compile(pat)))
+        except re.error as e:
+            log.error(f'{botName} column {label!r}: bad pattern {pat!r}: {e}')
+    return out
+
+
+def _birthdate(botConfig: Dict) -> Optional[datetime.datetime]:
+    if botConfig['birthdate'] is None:
+        return None
+    return parse(botConfig['birthdate']).replace(tzinfo=tz.gettz('UTC'))
+
+
+class Bots(dict):
+    """name : Bot, plus the outbox, journal and event bus they share.
+
+    Handlers keep this dict, so config reloads change it in place.
+
+    inline=True is for scripts that don't run the reactor: mongo calls and
+    journal inserts happen in the caller's thread before save() etc.
+    return, there's no chat, and no notifications go out."""
+    def __init__(self, chat, config: Config, slack=True, inline=False):
+        dict.__init__(self)
+        configureMongo(config.mongo)
+        self.chat = chat
+        self.slack = slack and not inline
+        self.inline = inline
+        self.config = config
+        self.outbox = None if inline else Outbox(chat)
+        self.journal = Journal(onFlushed=self._flushed,
+                               onInserted=self._inserted,
+                               inline=inline)
+        self.events = EventBus()
+        for botConfig in config.bots:
+            self._add(botConfig)
+
+    def _inserted(self, coll, docs: List[Dict]) -> None:
+        # recounting the days is safe to repeat, and replays do repeat
+        rollups.rebuildDays(coll,
+                            set(rollups.dayOf(doc['created']) for doc in docs))
+
+    def _flushed(self, botName):
+        if botName in self:
+            self[botName].bumpRevision()
+
+    def _add(self, botConfig: Dict) -> None:
+        name = botConfig['name']
         b = Bot(
-            botNode,
-            g,
-            str(name),
-            owners=set(g.objects(botNode, DB['owner'])),
-            chat=chat,
-            birthdate=birthdate,
-            structuredInput=structuredInputElementConfig(g, botNode),
+            URIRef(botConfig['uri']),
+            self.config,
+            name,
+            owners=set(URIRef(o) for o in botConfig['owners']),
+            chat=self.chat,
+            outbox=self.outbox,
+            journal=self.journal,
+            events=self.events,
+            birthdate=_birthdate(botConfig),
+            structuredInput=botConfig['structuredInput'],
+            token=botConfig['token'],
+            slack=self.slack,
+            inline=self.inline,
         )
-        bots[str(name)] = b
+        b.botConfig = botConfig
+        self[name] = b
+        b.store.ensureIndexes().addErrback(log.error)
+        self._setViews(b, botConfig)
+
+    def _setViews(self, b: 'Bot', botConfig: Dict) -> None:
+        b.historyColumns = historyColumns(botConfig['historyColumns'], b.name)
+        b.historyQueries = [
+            OffsetTime(daysAgo=hq['daysAgo'],
+                       labelAgo=hq['label'],
+                       urlSuffix=hq['urlSuffix'])
+            for hq in botConfig['historyQueries']
+        ]
+
+    def _remove(self, name: str) -> None:
+        b = self.pop(name)
+        b.stop()
+        self.chat.removeBot(b)
+
+    def reconfigure(self, config: Config) -> None:
+        """apply a new config to the running bots. Only bots whose uri or
+        token changed reconnect to chat; the rest keep their session and
+        nag timer and just take the new owners, entry choices, columns
+        and queries."""
+        if config.mongo != self.config.mongo:
+            log.warning('mongo settings changed; restart to use them')
+        self.config = config
+        wanted = {botConfig['name']: botConfig for botConfig in config.bots}
+
+        for name in list(self):
+            old = self[name].botConfig
+            new = wanted.get(name)
+            if new is None or (new['uri'], new['token']) != (old['uri'],
+                                                             old['token']):
+                log.info(f'config reload: removing bot {name}')
+                self._remove(name)
+
+        for name, botConfig in wanted.items():
+            if name not in self:
+                log.info(f'config reload: adding bot {name}')
+                self._add(botConfig)
+                continue
+            b = self[name]
+            b.config = config  # new conversions, even if this bot is as it was
+            if botConfig == b.botConfig:
+                continue
+            log.info(f'config reload: updating bot {name}')
+            b.botConfig = botConfig
+            b.owners = set(URIRef(o) for o in botConfig['owners'])
+            b.birthdate = _birthdate(botConfig)
+            b.structuredInput = botConfig['structuredInput']
+            self._setViews(b, botConfig)
+            b.bumpRevision()
 
-        b.historyQueries = []
-        for hq in g.objects(botNode, DB['historyQuery']):
-            b.historyQueries.append(
-                OffsetTime(daysAgo=int(g.value(hq, DB['daysAgo'])),
-                           labelAgo=g.value(hq, RDFS['label']),
-                           urlSuffix=str(g.value(hq, DB['urlSuffix']))))
 
-    return bots
+def makeBots(chat, config: Config, slack=True, inline=False) -> Bots:
+    return Bots(chat, config, slack=slack, inline=inline)
 
 
 class Bot:
-    """one slack account; one nag timer."""
+    """one slack account; one nag timer.
+
+    With slack=False there's neither: nothing is scheduled on the reactor
+    and chat isn't started, for scripts and --no-chat. inline is as in
+    Bots."""
     def __init__(
             self,
             uri: URIRef,
-            configGraph: Graph,
+            config: Config,
             name: str,
             owners: Set[URIRef],
-            chat: ChatInterface,
+            chat: 'ChatInterface',
+            outbox: Optional[Outbox],
+            journal: Journal,
+            events: EventBus,
             birthdate: Optional[datetime.datetime],
             structuredInput: Optional[Dict],
+            token: Optional[str],
             slack=True,
+            inline=False,
     ):
         self.uri = uri
-        self.configGraph = configGraph
+        self.config = config
+        self.slack = slack
         self.currentNag = None
+        self.stopped = False
         self.name = name
         self.owners = owners
         self.birthdate = birthdate
         self.structuredInput = structuredInput
         self.chat = chat
+        self.outbox = outbox
+        self.journal = journal
+        self.events = events
+        # goes up with every change to this bot's docs, for page caching
+        self.revision = 0
         self.repr = 'Bot(uri=%r,name=%r)' % (self.uri, self.name)
-        self.mongo = MongoClient('bang5', 27017)['diarybot'][self.name]
+        self.mongo = botCollection(self.name)
+        self.store = MongoStore(self.mongo, inline=inline)
 
         self.availableSubscribers = set()
 
+        self._statusSeeded = False
+        self._seedLock = DeferredLock()
+        # (docId, doc) noted while a seed is reading mongo, to apply after
+        self._notedDuringSeed: Optional[List[Tuple[ObjectId, Dict]]] = None
+        self._last: Optional[Dict] = None  # {'_id', 'created'} of newest doc
+        # drug : (docId, created, kvs) of its newest dose
+        self._lastDoses: Dict[Node, Tuple[ObjectId, datetime.datetime,
+                                          Dict[Node, Node]]] = {}
+
         self.nagDelay = 86400 * .5  # get this from the config
-        self.rescheduleNag()
+        if not slack:
+            return  # status gets read when it's first asked for
+        self.refreshStatus().addErrback(log.error)
 
         def finish():
             log.info('Bot.finish')
-            token = self.configGraph.value(self.uri,
-                                           DB['slackBotUserOauth']).toPython()
+            if self.stopped:
+                return
             d = self.chat.initBot(self, token)
             d.addErrback(log.error)
             return d
 
+        from twisted.internet import reactor
         reactor.callLater(0, finish)
 
+    def bumpRevision(self) -> None:
+        self.revision += 1
+
     def __repr__(self):
         return self.repr
 
@@ -120,23 +260,164 @@ class Bot:
             raise ValueError('not owner')
 
     def uriForDoc(self, d) -> URIRef:
-        return URIRef('http://bigasterisk.com/diary/%s/%s' %
-                      (self.name, d['_id']))
+        return uriForDoc(self.name, d)
+
+    def _readStatus(self, coll: Collection) -> Tuple[List[Dict], List[Dict]]:
+        """the newest live doc, and the latest dose of each drug from the
+        last 20 hours (grouped in mongo, so we only get one doc per drug)."""
+        nonDeleted = {'deleted': {'$exists': False}}
+        lastCreated = list(
+            coll.find(nonDeleted,
+                      projection=['created'],
+                      sort=[('created', -1)],
+                      limit=1))
+
+        now = datetime.datetime.now(tz.tzutc()).replace(tzinfo=tz.tzutc())
+        drugPairs = {
+            '$filter': {
+                'input': '$structuredInput',
+                'as': 'kv',
+                'cond': {
+                    '$eq': [{
+                        '$arrayElemAt': ['$$kv', 0]
+                    }, SCHEMA['drug'].n3()]
+                }
+            }
+        }
+        latestDoses = list(
+            coll.aggregate([
+                {
+                    '$match': {
+                        'deleted': {
+                            '$exists': False
+                        },
+                        'structuredInput': {
+                            '$exists': True
+                        },
+                        'created': {
+                            '$gt': now - datetime.timedelta(hours=20)
+                        }
+                    }
+                },
+                {
+                    '$sort': {
+                        'created': -1
+                    }
+                },
+                {
+                    '$addFields': {
+                        'drugPair': {
+                            '$arrayElemAt': [drugPairs, 0]
+                        }
+                    }
+                },
+                {
+                    '$match': {
+                        'drugPair': {
+                            '$exists': True
+                        }
+                    }
+                },
+                {
+                    '$group': {
+                        '_id': {
+                            '$arrayElemAt': ['$drugPair', 1]
+                        },
+                        'docId': {
+                            '$first': '$_id'
+                        },
+                        'created': {
+                            '$first': '$created'
+                        },
+                        'structuredInput': {
+                            '$first': '$structuredInput'
+                        },
+                    }
+                },
+            ]))
+        return lastCreated, latestDoses
+
+    async def _seedStatus(self):
+        """fill the status cache from mongo, plus the docs mongo may not
+        have yet: ones still in the journal, and ones saved while we were
+        reading. After this, _save, delete and updateTime keep it current."""
+        await self._seedLock.acquire()
+        try:
+            pending = [(doc['_id'], doc)
+                       for collName, doc in self.journal.pending
+                       if collName == self.name]
+            self._notedDuringSeed = []
+            try:
+                lastCreated, latestDoses = await self.store.call(
+                    self._readStatus)
+                notedDuring = self._notedDuringSeed
+            finally:
+                self._notedDuringSeed = None
+            self._last = lastCreated[0] if lastCreated else None
+
+            doses = {}
+            for doc in latestDoses:
+                kvs = kvFromMongoList(doc['structuredInput'])
+                doses[kvs[SCHEMA['drug']]] = (doc['docId'], doc['created'],
+                                              kvs)
+            self._lastDoses = doses
+            for docId, doc in pending + notedDuring:
+                self._noteNewDoc(docId, doc)
+            self._statusSeeded = True
+        finally:
+            self._seedLock.release()
+
+    async def _ensureSeeded(self) -> None:
+        if not self._statusSeeded:
+            await self._seedStatus()
+
+    async def reportUncoveredQueries(self, queries: List[Query]) -> None:
+        """log the status and history finds that would scan the whole
+        collection."""
+        runs = [('status', self._readStatus)]
+        runs.extend((q.name, q.run) for q in queries)
+        for name, run in runs:
+            for spec in await self.store.uncoveredFinds(run):
+                log.warning(f'{self.name} {name}: no index for {spec}')
+
+    def refreshStatus(self) -> Deferred:
+        """reread the status cache, then reschedule the nag from it."""
+        async def go():
+            await self._seedStatus()
+            self.rescheduleNag()
+
+        return ensureDeferred(go())
+
+    def _noteNewDoc(self, docId, doc: Dict):
+        """status cache update for a newly inserted doc."""
+        if self._notedDuringSeed is not None:
+            self._notedDuringSeed.append((docId, doc))
+        created = doc['created'].astimezone(tz.tzutc()).replace(tzinfo=None)
+        if self._last is None or created >= self._last['created']:
+            self._last = {'_id': docId, 'created': created}
+        if 'structuredInput' in doc:
+            kvs = kvFromMongoList(doc['structuredInput'])
+            if SCHEMA['drug'] in kvs:
+                drug = kvs[SCHEMA['drug']]
+                prev = self._lastDoses.get(drug)
+                if prev is None or created >= prev[1]:
+                    self._lastDoses[drug] = (docId, created, kvs)
+
+    def _statusUses(self, docId) -> bool:
+        """is this doc one of the ones the status cache is showing?"""
+        if self._last is not None and self._last['_id'] == docId:
+            return True
+        return any(d[0] == docId for d in self._lastDoses.values())
 
     def lastUpdateTime(self) -> Optional[float]:
         """seconds, or None if there are no updates."""
-        nonDeleted = {'deleted': {'$exists': False}}
-        lastCreated = self.mongo.find(nonDeleted,
-                                      projection=['created'
-                                                  ]).sort('created',
-                                                          -1).limit(1)
-        lastCreated = list(lastCreated)
-        if not lastCreated:
+        if self._last is None:
             return None
-        return float(lastCreated[0]['created'].strftime('%s'))
+        return float(self._last['created'].strftime('%s'))
 
-    def getStatus(self) -> str:
+    async def getStatus(self) -> str:
         """user asked '?'."""
+        await self._ensureSeeded()
         last = self.lastUpdateTime()
         now = time.time()
         if last is None:
@@ -166,55 +447,71 @@ class Bot:
         now = datetime.datetime.now(tz.tzutc()).replace(tzinfo=tz.tzutc())
         reports = []
 
-        drugsSeen = set()
-        for doc in self.mongo.find({
-                'deleted': {
-                    '$exists': False
-                },
-                'structuredInput': {
-                    '$exists': True
-                },
-                'created': {
-                    '$gt': now - datetime.timedelta(hours=20)
-                }
-        }).sort('created', -1):
-            kvs = kvFromMongoList(doc['structuredInput'])
-            if SCHEMA['drug'] in kvs:
-                if kvs[SCHEMA['drug']] not in drugsSeen:
-                    drugsSeen.add(kvs[SCHEMA['drug']])
-                    msg = englishInput(self.configGraph, kvs)
-                    if msg:
-                        createdZ = doc['created'].replace(tzinfo=tz.tzutc())
-                        secAgo = (now - createdZ).total_seconds()
-                        # and link to the entry
-                        msg += ' %.2f hours ago' % (secAgo / 3600.)
-                        reports.append(msg)
+        for docId, created, kvs in sorted(self._lastDoses.values(),
+                                          key=lambda d: d[1],
+                                          reverse=True):
+            createdZ = created.replace(tzinfo=tz.tzutc())
+            secAgo = (now - createdZ).total_seconds()
+            if secAgo > 20 * 3600:
+                continue
+            msg = englishInput(self.config.conversions, kvs)
+            if msg:
+                # and link to the entry
+                msg += ' %.2f hours ago' % (secAgo / 3600.)
+                reports.append(msg)
         return reports
 
+    def stop(self) -> None:
+        """no more nags, e.g. after the bot is dropped from the config"""
+        self.stopped = True
+        if self.currentNag is not None and self.currentNag.active():
+            self.currentNag.cancel()
+        self.currentNag = None
+        STATS.nextNag[self.name] = ''
+
     def rescheduleNag(self):
-        if self.currentNag is not None and not self.currentNag.cancelled:
+        if self.currentNag is not None and self.currentNag.active():
             self.currentNag.cancel()
+        if self.stopped or not self.slack:
+            return
 
         last = self.lastUpdateTime()
         if last is None:
             dt = 10
         else:
-            dt = max(10, self.nagDelay - (time.time() - self.lastUpdateTime()))
+            dt = max(10, self.nagDelay - (time.time() - last))
 
         def go():
             return ensureDeferred(self.sendNag())
 
         log.info(f'rescheduleNag {self.name} to {dt}')
+        from twisted.internet import reactor
         self.currentNag = reactor.callLater(dt, go)
+        STATS.nextNag[self.name] = datetime.datetime.fromtimestamp(
+            time.time() + dt, tz.tzlocal()).isoformat()
 
     async def sendNag(self):
         self.currentNag = None
+        STATS.nextNag[self.name] = ''
         msg = "What's up?"
+
+        async def nag(owner) -> bool:
+            if not await self.chat.userIsOnline(owner):
+                return False
+            await withTimeout(self.chat.sendMsg(self, owner, msg),
+                              self.outbox.timeout)
+            STATS.nagsSent[self.name] += 1
+            return True
+
+        results = await DeferredList(
+            [ensureDeferred(nag(owner)) for owner in self.owners],
+            consumeErrors=True)
         reachedAtLeastOOne = False
-        for owner in self.owners:
-            if await self.chat.userIsOnline(owner):
-                await self.chat.sendMsg(self, owner, msg)
-                reachedAtLeastOOne = True
+        for ok, result in results:
+            if ok:
+                reachedAtLeastOOne = reachedAtLeastOOne or result
+            else:
+                log.error(f'nag failed: {result.getErrorMessage()}')
         if not reachedAtLeastOOne:
             self.rescheduleNag()
 
@@ -235,9 +532,14 @@ class Bot:
             doc['sioc:content'] = msg
         elif kv:
             doc['structuredInput'] = mongoListFromKv(kv)
-            msg = 'structured input: %r' % englishInput(self.configGraph, kv)
+            # kv is n3 strings; the conversions want parsed terms
+            doc['searchText'] = englishInput(
+                self.config.conversions,
+                kvFromMongoList(doc['structuredInput']))
+            msg = 'structured input: %r' % doc['searchText']
         else:
             raise ValueError("no message")
+        doc.update(eventFields(doc))
         return doc, msg
 
     def save(self, userUri: URIRef, msg: Optional[str] = None, kv: Optional[Dict[str, str]] = None) -> Deferred:
@@ -251,33 +553,56 @@ class Bot:
 
         doc, formatMsg = self._mongoDoc(user, msg, kv)
 
-        newId = self.mongo.insert_one(doc).inserted_id
+        # the journal gets it into mongo soon, even if mongo is down now
+        newId = doc['_id'] = ObjectId()
+        self.journal.append(self.name, doc)
+        self.bumpRevision()
         newUri = self.uriForDoc({'_id': newId})
+        try:
+            # so a first read can't replace what _noteNewDoc adds
+            await self._ensureSeeded()
+        except Exception as e:
+            log.error(f'status read failed: {e!r}')
+        self._noteNewDoc(newId, doc)
 
         try:
-            await self._tellEveryone(doc, formatMsg)
+            self._tellEveryone(doc, formatMsg)
             self.rescheduleNag()
+            await self._publish('save', newId, doc['dc:created'], formatMsg)
         except Exception as e:
             log.error(e)
             log.info("failed alerts don't stop save from succeeding")
 
         return newUri
 
-    def delete(self, user: URIRef, docId):
-        self.assertUserCanWrite(user)
+    def delete(self, user: URIRef, docId) -> Deferred:
+        return ensureDeferred(self._delete(user, docId))
 
-        now = datetime.datetime.now(tz.tzlocal())
-
-        oldRow = self.mongo.find_one({
+    async def _editableRow(self, docId) -> Dict:
+        """the live doc to change. One still in the journal can't be
+        edited yet, since the edit would go to mongo ahead of it."""
+        if self.journal.pendingDoc(self.name, ObjectId(docId)) is not None:
+            raise ValueError(f'{docId} is still being saved')
+        oldRow = await self.store.findOne({
             '_id': ObjectId(docId),
             'deleted': {
                 '$exists': False
             }
         })
+        if oldRow is None:
+            raise ValueError(f'no live doc {docId}')
+        return oldRow
+
+    async def _delete(self, user: URIRef, docId):
+        self.assertUserCanWrite(user)
+
+        now = datetime.datetime.now(tz.tzlocal())
+
+        oldRow = await self._editableRow(docId)
         if 'history' in oldRow:
             del oldRow['history']
         del oldRow['_id']
-        self.mongo.find_one_and_update({'_id': ObjectId(docId)}, {
+        await self.store.findOneAndUpdate({'_id': ObjectId(docId)}, {
             '$push': {
                 'history': oldRow
             },
@@ -290,22 +615,35 @@ class Bot:
             '$unset': {
                 'sioc:content': '',
                 'structuredInput': '',
+                'searchText': '',
+                'eventKind': '',
             },
         })
 
-    def updateTime(self, user: URIRef, docId, newTime):
+        await self.store.call(lambda coll: rollups.rebuildDays(
+            coll, [rollups.dayOf(oldRow['created'])]))
+
+        await self._ensureSeeded()
+        if self._statusUses(ObjectId(docId)):
+            await self.refreshStatus()
+        self.bumpRevision()
+        try:
+            await self._publish('delete', ObjectId(docId))
+        except Exception as e:
+            log.error(e)
+            log.info("failed alerts don't stop delete from succeeding")
+
+    def updateTime(self, user: URIRef, docId, newTime) -> Deferred:
+        return ensureDeferred(self._updateTime(user, docId, newTime))
+
+    async def _updateTime(self, user: URIRef, docId, newTime):
         self.assertUserCanWrite(user)
 
-        oldRow = self.mongo.find_one({
-            '_id': ObjectId(docId),
-            'deleted': {
-                '$exists': False
-            }
-        })
+        oldRow = await self._editableRow(docId)
         if 'history' in oldRow:
             del oldRow['history']
         del oldRow['_id']
-        self.mongo.find_one_and_update({'_id': ObjectId(docId)}, {
+        await self.store.findOneAndUpdate({'_id': ObjectId(docId)}, {
             '$push': {
                 'history': oldRow
             },
@@ -313,23 +651,52 @@ class Bot:
                 'dc:created': newTime.isoformat(),
                 'dc:creator': user,
                 'created': newTime.astimezone(tz.gettz('UTC')),
+                'localHour': hourOfDay(newTime.isoformat()),
             },
         })
 
-    async def _tellEveryone(self, doc: Dict, formatMsg: str) -> None:
+        await self.store.call(lambda coll: rollups.rebuildDays(
+            coll, [rollups.dayOf(oldRow['created']),
+                   rollups.dayOf(newTime)]))
+
+        docId = ObjectId(docId)
+        await self._ensureSeeded()
+        if self._statusUses(docId) or 'structuredInput' in oldRow:
+            await self.refreshStatus()
+        else:
+            self._noteNewDoc(docId, {'created': newTime})
+            self.rescheduleNag()
+        self.bumpRevision()
+        try:
+            await self._publish('updateTime', docId, newTime.isoformat())
+        except Exception as e:
+            log.error(e)
+            log.info("failed alerts don't stop updateTime from succeeding")
+
+    async def _publish(self,
+                       kind: str,
+                       docId: ObjectId,
+                       created: Optional[str] = None,
+                       content: Optional[str] = None) -> None:
+        """tell web clients about a change, with the new status line"""
+        self.events.publish(
+            self.name, {
+                'kind': kind,
+                'uri': self.uriForDoc({'_id': docId}),
+                'created': created,
+                'content': content,
+                'status': await self.getStatus(),
+            })
+
+    def _tellEveryone(self, doc: Dict, formatMsg: str) -> None:
+        """queues the notifications; the outbox sends them later"""
         user: URIRef = doc['dc:creator']
 
         msg = '%s wrote: %s' % (user, formatMsg)
 
+        if self.outbox is None:
+            return  # inline; see Bots
         for otherOwner in self.owners:
             if otherOwner == user:
                 continue
-            if await self.chat.userIsOnline(otherOwner):
-                await self.chat.sendMsg(self, otherOwner, msg)
-            else:
-                requests.post('http://bang5:9040/',
-                              data={
-                                  'user': otherOwner,
-                                  'msg': msg,
-                                  'mode': 'email'
-                              })
+            self.outbox.send(self, otherOwner, msg)
@@ -1,43 +1,91 @@
 #!/usr/bin/python
-"""send diarybot entries to search."""
+"""send new diarybot entries to search.
+
+Only docs newer than the last run's high-water mark (per bot, on _id) are
+sent, streamed from mongo and checkpointed after every batch, so a rerun
+or a crash costs at most one batch of repeats.
+"""
+import json
 import logging
+import os
+
 import requests
-import json
-from pymongo import MongoClient as Connection
-from chatinterface import ChatInterface
-from rdflib import Graph
-from bot import makeBots
+from bson import ObjectId
+
+from configsnapshot import loadConfig
+from storage import botCollection, configureMongo, uriForDoc
 
 logging.basicConfig(level=logging.WARN)
 log = logging.getLogger()
 log.setLevel(logging.WARN)
 
-configGraph = Graph()
-configGraph.parse('bots-secret.n3', format='n3')
-chat = ChatInterface(lambda *a: None)
-bots = makeBots(chat, configGraph)
+STATE_FILE = 'buildIndex.state.json'
+INDEXER = 'http://bang:9096/index'
+batchSize = 100
+
+
+def readState():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def writeState(state):
+    tmp = STATE_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
 
 
-for botName in ['aribot', 'asherbot']:
-    coll = Connection('bang', 27017)['diarybot'][botName]
-    for row in coll.find():
+def searchDoc(botName, row):
+    label = {
+        'http://bigasterisk.com/kelsi/foaf.rdf#kelsi': 'Kelsi',
+        'http://bigasterisk.com/foaf.rdf#drewp': 'Drew',
+    }.get(row['dc:creator'], row['dc:creator'])
+
+    return dict(uri=uriForDoc(botName, row),
+                title='%s entry by %s at %s' % (
+                    botName, label, row['dc:created']),
+                text=row['sioc:content'])
+
+
+def exportBot(session, state, botName):
+    spec = {'deleted': {'$exists': False}}
+    if botName in state:
+        spec['_id'] = {'$gt': ObjectId(state[botName])}
+    rows = botCollection(botName).find(
+        spec,
+        projection=['dc:creator', 'dc:created', 'sioc:content'],
+        sort=[('_id', 1)],
+        batch_size=batchSize)
+
+    sent = 0
+    for seen, row in enumerate(rows, 1):
         try:
-            txt = row['sioc:content']
-            uri = bots[botName].uriForDoc(row)
-
-            label = {
-                'http://bigasterisk.com/kelsi/foaf.rdf#kelsi': 'Kelsi',
-                'http://bigasterisk.com/foaf.rdf#drewp': 'Drew',
-            }.get(row['dc:creator'], row['dc:creator'])
-
-            doc = dict(uri=uri,
-                       title='%s entry by %s at %s' % (
-                           botName, label, row['dc:created']),
-                       text=txt)
-            requests.post(
-                'http://bang:9096/index',
-                params={
-                    'source': botName},
-                data=json.dumps(doc)).raise_for_status()
+            doc = searchDoc(botName, row)
         except KeyError as e:
             log.warn('%s: %r', row['_id'], e)
+        else:
+            session.post(INDEXER,
+                         params={'source': botName},
+                         data=json.dumps(doc)).raise_for_status()
+            sent += 1
+        state[botName] = str(row['_id'])
+        if seen % batchSize == 0:
+            writeState(state)
+    writeState(state)
+    log.info('%s: sent %s docs', botName, sent)
+
+
+def main():
+    configureMongo(loadConfig().mongo)
+    state = readState()
+    # one keep-alive connection for the whole run
+    session = requests.Session()
+    for botName in ['aribot', 'asherbot']:
+        exportBot(session, state, botName)
+
+
+if __name__ == '__main__':
+    main()
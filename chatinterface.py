@@ -1,11 +1,12 @@
 # Must come first to set twisted's default reactor.
+import reactorsetup
 import asyncio
-from twisted.internet import asyncioreactor, defer
-asyncioreactor.install(asyncio.get_event_loop())
+from twisted.internet import defer
 
-from typing import Dict, Coroutine, Union, Any, Callable
+from typing import Dict, Coroutine, Union, Any, Callable, Hashable, Tuple
 import slack
 import logging
+import time
 import aiohttp
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
@@ -14,6 +15,8 @@ from slack.events import Message
 from rdflib import URIRef
 from pprint import pprint
 
+from metrics import STATS
+
 log = logging.getLogger('chat')
 BotType = Any  # workaround for cycle?
 # see https://meejah.ca/blog/python3-twisted-and-asyncio
@@ -37,25 +40,89 @@ class ChatInterface(object):
 
         self.session = aiohttp.ClientSession()
         self.slack_client: Dict[BotType, SlackAPI] = {}
-        self._botChannel = {}
+        self._rtm: Dict[BotType, Deferred] = {}  # bot : its setup and rtm loop
+
+        # (bot, user slack id) : IM channel id
+        self._botChannel: Dict[Tuple[BotType, str], str] = {}
+        self._botChannelsRead: Dict[BotType, float] = {}
         self._userSlackId: Dict[URIRef, str] = {}
         self._slackUserUri: Dict[str, URIRef] = {}
+        self._userListRead = 0.
+        self.cacheTtl = 3600
+        # a channel we haven't seen may have been opened since the last
+        # scan, so a miss rescans, but no more often than this
+        self.channelRescanSecs = 60
+
+        # key : lookup in progress, so concurrent misses share one scan
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.apiCalls: Dict[str, int] = {}  # slack method name : count
+
+    def _countCall(self, method) -> str:
+        name = getattr(method, 'name', str(method))
+        self.apiCalls[name] = self.apiCalls.get(name, 0) + 1
+        STATS.slackCalls[name] += 1
+        return name
+
+    async def _query(self, client: SlackAPI, method, data=None):
+        name = self._countCall(method)
+        t1 = time.time()
+        try:
+            return await client.query(method, data=data)
+        except Exception:
+            STATS.slackErrors[name] += 1
+            raise
+        finally:
+            STATS.slackTime[name] = time.time() - t1
+
+    async def _iter(self, client: SlackAPI, method, data=None):
+        """counts (and times) the whole paginated scan as one call"""
+        name = self._countCall(method)
+        t1 = time.time()
+        try:
+            async for item in client.iter(method, data=data):
+                yield item
+        except Exception:
+            STATS.slackErrors[name] += 1
+            raise
+        finally:
+            STATS.slackTime[name] = time.time() - t1
+
+    async def _singleFlight(self, key: Hashable,
+                            make: Callable[[], Coroutine]) -> Any:
+        if key not in self._inflight:
+            fut = self._inflight[key] = asyncio.ensure_future(make())
+            fut.add_done_callback(lambda f: self._inflight.pop(key, None))
+        # one caller getting cancelled mustn't cancel the others
+        return await asyncio.shield(self._inflight[key])
 
     def initBot(self, bot: BotType, token: str) -> Deferred:
         self.slack_client[bot] = SlackAPI(token=token, session=self.session)
 
-        return as_deferred(self._setup(bot))
+        d = self._rtm[bot] = as_deferred(self._setup(bot))
+        d.addErrback(lambda f: f.trap(defer.CancelledError))  # removeBot
+        return d
+
+    def removeBot(self, bot: BotType) -> None:
+        """disconnect a bot that was dropped (or changed) in the config"""
+        d = self._rtm.pop(bot, None)
+        if d is not None:
+            d.cancel()
+        self.slack_client.pop(bot, None)
+        self._botChannelsRead.pop(bot, None)
+        for key in [k for k in self._botChannel if k[0] == bot]:
+            del self._botChannel[key]
 
     async def _setup(self, bot: BotType) -> None:
         client = self.slack_client[bot]
         log.info('_setup auth.test')
-        ret = await client.query(slack.methods.AUTH_TEST)
+        ret = await self._query(client, slack.methods.AUTH_TEST)
         user_id = ret['user_id']
         # ret['user'] might actually be mangled like 'healthbot2', so it might
         # differ from bot.name.
 
-        ret = await client.query(slack.methods.USERS_INFO,
-                                 data={'user': user_id})
+        ret = await self._query(client,
+                                slack.methods.USERS_INFO,
+                                data={'user': user_id})
         bot_id = ret['user']['profile']['bot_id']
 
         log.info(f'{bot} rtm starts')
@@ -91,8 +158,9 @@ class ChatInterface(object):
                 as_user=False,
             )
             pprint({'post': post})
-            await self.slack_client[bot].query(slack.methods.CHAT_POST_MESSAGE,
-                                               data=post)
+            await self._query(self.slack_client[bot],
+                              slack.methods.CHAT_POST_MESSAGE,
+                              data=post)
         except Exception:
             log.error('sendMsg failed:')
             import traceback
@@ -107,18 +175,41 @@ class ChatInterface(object):
             raise ValueError("no slack clients")
         return next(iter(self.slack_client.values()))
 
+    def _fresh(self, readTime: float) -> bool:
+        return time.time() - readTime < self.cacheTtl
+
     async def _channelWithUser(self, bot: URIRef, user: URIRef) -> str:
         userSlackId = await self._slackIdForUser(user)
-        async for chan in self.slack_client[bot].iter(
-                slack.methods.CONVERSATIONS_LIST, data={'types': 'im'}):
-            if chan['user'] == userSlackId:
-                return chan['id']
-        raise ValueError(
-            f'no channel between bot {bot.uri} and user {userSlackId!r}')
+        key = (bot, userSlackId)
+        if (key not in self._botChannel and
+                time.time() - self._botChannelsRead.get(bot, 0) >=
+                self.channelRescanSecs):
+            await self._singleFlight(('channels', bot),
+                                     lambda: self._readChannels(bot))
+        try:
+            return self._botChannel[key]
+        except KeyError:
+            raise ValueError(
+                f'no channel between bot {bot.uri} and user {userSlackId!r}')
+
+    async def _readChannels(self, bot: BotType):
+        """remember all of this bot's IM channels, since we have to page
+        through them anyway."""
+        async for chan in self._iter(self.slack_client[bot],
+                                     slack.methods.CONVERSATIONS_LIST,
+                                     data={'types': 'im'}):
+            self._botChannel[(bot, chan['user'])] = chan['id']
+        self._botChannelsRead[bot] = time.time()
+
+    async def _readUserListOnce(self):
+        """reread the user list only if it's stale, and only once for any
+        number of concurrent callers."""
+        if not self._fresh(self._userListRead):
+            await self._singleFlight('users', self._readUserList)
 
     async def _readUserList(self):
         client = self.anyClient()
-        async for member in client.iter(slack.methods.USERS_LIST):
+        async for member in self._iter(client, slack.methods.USERS_LIST):
             log.info(
                 f'slack user {member["id"]!r} has name {member["name"]!r}')
             userUriForSlackName = {
@@ -129,31 +220,21 @@ class ChatInterface(object):
                 uri = userUriForSlackName[member['name']]
                 self._userSlackId[uri] = member['id']
                 self._slackUserUri[member['id']] = uri
+        self._userListRead = time.time()
 
     async def _slackIdForUser(self, user: URIRef) -> str:
         if user in self._userSlackId:
             return self._userSlackId[user]
 
-        await self._readUserList()
+        await self._readUserListOnce()
         return self._userSlackId[user]
 
     async def _userFromSlackId(self, slackUser: str) -> URIRef:
         if slackUser in self._slackUserUri:
             return self._slackUserUri[slackUser]
-        await self._readUserList()
+        await self._readUserListOnce()
         return self._slackUserUri[slackUser]
 
-class NoChat:
-    def initBot(self, bot: BotType, token: str) -> Deferred:
-        return defer.succeed(None)
-    def sendMsg(self, bot: BotType, toUser: URIRef, msg: str) -> Deferred:
-        return defer.succeed(None)
-    async def userIsOnline(self, user: URIRef):
-        return False
-    def anyClient(self) -> SlackAPI:
-        raise ValueError("no chat")
-
-
 async def _main(reactor):
     def onMsg(bot, user, msg):
         reactor.callLater(
@@ -0,0 +1,167 @@
+"""bots-secret.n3, compiled to plain python.
+
+Parsing the n3 and querying it was most of startup, so loadConfig keeps the
+compiled form next to the config file (as <path>.snapshot.json, which has
+the bot tokens in it) and reuses it until the config file's hash changes.
+Nothing after startup reads the rdf graph.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional
+
+from rdflib import Graph, Namespace, RDF, RDFS, URIRef
+from rdflib.collection import Collection as RdfList
+from twisted.internet.task import LoopingCall
+
+from structuredinput import (NaturalInputConversions, conversionRules,
+                             structuredInputElementConfig)
+
+log = logging.getLogger('config')
+
+DB = Namespace('http://bigasterisk.com/ns/diaryBot#')
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+BIO = Namespace('http://vocab.org/bio/0.1/')
+
+# bump when compileConfig's output changes, so old snapshots get rebuilt
+SNAPSHOT_VERSION = 1
+
+
+def _historyColumnSpecs(g: Graph,
+                        botNode: URIRef) -> Optional[List[List[str]]]:
+    """[label, regex] from a list like
+      :historyColumns ( [ rdfs:label "off"; :pattern "^off$" ] ... )
+    or None for the default columns"""
+    listNode = g.value(botNode, DB['historyColumns'])
+    if listNode is None:
+        return None
+    return [[str(g.label(c)), str(g.value(c, DB['pattern']))]
+            for c in RdfList(g, listNode)]
+
+
+def _botConfig(g: Graph, botNode: URIRef) -> Dict:
+    birth = next((g.value(ev, BIO['date'])
+                  for ev in g.objects(botNode, BIO['event'])
+                  if (ev, RDF.type, BIO['Birth']) in g), None)
+    token = g.value(botNode, DB['slackBotUserOauth'])
+    return {
+        'uri': str(botNode),
+        'name': str(g.label(botNode)),
+        'birthdate': None if birth is None else str(birth),
+        'owners': sorted(str(o) for o in g.objects(botNode, DB['owner'])),
+        'token': None if token is None else str(token),
+        'structuredInput': structuredInputElementConfig(g, botNode),
+        'historyColumns': _historyColumnSpecs(g, botNode),
+        'historyQueries': [{
+            'daysAgo': int(g.value(hq, DB['daysAgo'])),
+            'label': str(g.value(hq, RDFS['label'])),
+            'urlSuffix': str(g.value(hq, DB['urlSuffix'])),
+        } for hq in g.objects(botNode, DB['historyQuery'])],
+    }
+
+
+def compileConfig(g: Graph) -> Dict:
+    """everything the app reads from the config graph, as the plain values
+    a snapshot file loads back as (rdflib terms don't compare equal to
+    their strings, and Bots.reconfigure compares these)"""
+    mongo = {}
+    for key, pred in [('host', 'mongoHost'), ('port', 'mongoPort'),
+                      ('maxPoolSize', 'mongoPoolSize')]:
+        value = next(g.objects(None, DB[pred]), None)
+        if value is not None:
+            mongo[key] = value.toPython()
+
+    return json.loads(json.dumps({
+        'version':
+        SNAPSHOT_VERSION,
+        'bots': [
+            _botConfig(g, botNode) for botNode in sorted(
+                set(g.subjects(RDF.type, DB['DiaryBot'])))
+            if g.label(botNode)
+        ],
+        'mongo':
+        mongo,
+        'conversions':
+        conversionRules(g),
+        'labels': {
+            str(s): str(o)
+            for s, o in g.subject_objects(RDFS.label)
+            if isinstance(s, URIRef)
+        },
+        'foafNames': {str(s): str(o)
+                      for s, o in g.subject_objects(FOAF['name'])},
+    }))
+
+
+class Config:
+    """a compiled snapshot, plus the lookups built from it"""
+    def __init__(self, snapshot: Dict):
+        self.sourceHash: Optional[str] = snapshot.get('sourceHash')
+        self.bots: List[Dict] = snapshot['bots']
+        self.mongo: Dict = snapshot['mongo']
+        self.foafNames: Dict[str, str] = snapshot['foafNames']
+        self.conversions = NaturalInputConversions(snapshot['conversions'],
+                                                   snapshot['labels'])
+
+
+def loadConfig(path: str = 'bots-secret.n3') -> Config:
+    with open(path, 'rb') as f:
+        source = f.read()
+    sourceHash = hashlib.sha256(source).hexdigest()
+    snapshotPath = path + '.snapshot.json'
+    try:
+        with open(snapshotPath) as f:
+            snapshot = json.load(f)
+        if (snapshot.get('version') == SNAPSHOT_VERSION and
+                snapshot.get('sourceHash') == sourceHash):
+            return Config(snapshot)
+    except (OSError, ValueError):
+        pass
+
+    log.info(f'compiling {path}')
+    g = Graph()
+    g.parse(path, format='n3')
+    snapshot = compileConfig(g)
+    snapshot['sourceHash'] = sourceHash
+
+    tmp = snapshotPath + '.tmp'
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600),
+                   'w') as f:
+        json.dump(snapshot, f, indent=1)
+    os.replace(tmp, snapshotPath)
+    return Config(snapshot)
+
+
+def watchConfig(path: str,
+                current: Config,
+                onChange: Callable[[Config], None],
+                interval: float = 2) -> LoopingCall:
+    """polls path, and calls onChange(newConfig) when its contents change.
+    A config that fails to load is logged and the old one stays."""
+    state = {'hash': current.sourceHash, 'stat': None}
+
+    def poll():
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            log.warning(f'config watch: {e}')
+            return
+        stat = (st.st_mtime, st.st_size)
+        if stat == state['stat']:
+            return
+        state['stat'] = stat
+        try:
+            config = loadConfig(path)
+        except Exception as e:
+            log.error(f'config reload failed; keeping the old one: {e!r}')
+            return
+        if config.sourceHash == state['hash']:
+            return
+        state['hash'] = config.sourceHash
+        log.info(f'{path} changed')
+        onChange(config)
+
+    loop = LoopingCall(poll)
+    loop.start(interval, now=True)
+    return loop
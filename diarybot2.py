@@ -1,25 +1,39 @@
+import collections
+import datetime
+import hashlib
 import importlib
+import itertools
 import json
-import re
 import sys
+import urllib.parse
 import docopt
 import os
+import time
+from typing import Dict, Hashable, Optional, Tuple
 
 # sets twisted's global reactor
-from chatinterface import ChatInterface, NoChat
+import reactorsetup
 
 from bson import ObjectId
+from dateutil import tz
 from dateutil.parser import parse
-from rdflib import Namespace, Graph, URIRef, RDF
+from rdflib import Namespace, URIRef
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, gatherResults, Deferred, succeed
+import cyclone.sse
 import cyclone.template
 import cyclone.web
 from twisted.internet.defer import ensureDeferred
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+from greplin.scales.cyclonehandler import StatsHandler
 
 from bot import makeBots, Bot
+from configsnapshot import Config, loadConfig, watchConfig
 import history_queries
 from loginbar import getLoginBar
+from nochat import NoChat
+from metrics import startLagMonitor, STATS
 from request_handler_fix import FixRequestHandler
 from standardservice.logsetup import log, verboseLogging
 from structuredinput import kvFromMongoList, englishInput
@@ -30,8 +44,46 @@ FOAF = Namespace('http://xmlns.com/foaf/0.1/')
 
 loader = cyclone.template.Loader('.')
 
+CONFIG_PATH = 'bots-secret.n3'
+
 _foafName = {}  # uri : name
 
+# distinguishes our revision numbers from the previous process's
+_startToken = '%x' % int(time.time())
+
+
+class PageCache:
+    """rendered pages, least recently used dropped first"""
+    def __init__(self, maxPages=200, maxPageBytes=2000000):
+        self.maxPages = maxPages
+        self.maxPageBytes = maxPageBytes
+        self.pages: Dict[Hashable, Tuple[str, str]] = collections.OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, str]]:
+        """(content type, body) or None"""
+        if key not in self.pages:
+            return None
+        self.pages.move_to_end(key)
+        return self.pages[key]
+
+    def put(self, key: Hashable, contentType: str, body: str) -> None:
+        if len(body) > self.maxPageBytes:
+            return
+        self.pages[key] = (contentType, body)
+        while len(self.pages) > self.maxPages:
+            self.pages.popitem(last=False)
+
+
+_pageCache = PageCache()
+
+
+def forgetPages() -> None:
+    """after a config reload, since names and entry choices on the pages
+    aren't part of the cache keys"""
+    global _startToken
+    _startToken = '%x' % int(time.time() * 1000)
+    _pageCache.pages.clear()
+
 
 def visibleBots(bots, agent: URIRef):
     visible = set()
@@ -44,13 +96,20 @@ def visibleBots(bots, agent: URIRef):
     return sorted(visible, key=lambda b: (len(b.owners), b.name))
 
 
-def getDoc(bot, agent, docId):
+def getDoc(bot, agent, docId) -> Deferred:
     bot.assertUserCanRead(agent)
-    return bot.mongo.find_one({'_id': ObjectId(docId)})  # including deleted
+    pending = bot.journal.pendingDoc(bot.name, ObjectId(docId))
+    if pending is not None:
+        return succeed(pending)
+    return bot.store.findOne({'_id': ObjectId(docId)})  # including deleted
+
+
+def isPending(bot, docId) -> bool:
+    """saved, but only to the journal so far"""
+    return bot.journal.pendingDoc(bot.name, ObjectId(docId)) is not None
 
 
-def prettyDate(iso, birthdate=None):
-    dt = parse(iso)
+def prettyDate(dt, birthdate=None):
     msg = dt.strftime('%Y-%m-%d <span class="dow">%a</span> %H:%M')
     if birthdate:
         age = dt - birthdate
@@ -61,7 +120,169 @@ def prettyDate(iso, birthdate=None):
     return msg
 
 
+def prettyMatch(content, pat) -> str:
+    try:
+        return '1' if pat.search(content) else ''
+    except Exception:
+        return ''
+
+
+def dayGrid(startHour, numHours, plotHour, label):
+    cells = []
+    for hr in range(startHour, startHour + numHours):
+        hr = hr % 24
+        marker = ''
+        if hr <= plotHour < hr + 1:
+            pct = (plotHour - hr) * 100
+            marker = f'''
+             <span class="marker"
+                   style="left: {pct}%">⮛ {label}</span>'''
+        cells.append(f'<span>{hr}{marker}</span>')
+    return f'<span class="dayGrid">{"".join(cells)}</span>'
+
+
+def rowTemplateArgs(bot, query, otherQueries, agent) -> Dict:
+    """everything diaryviewrows.html and its page templates use, besides
+    entries."""
+    def prettyName(uri):
+        return _foafName.get(URIRef(uri), uri)
+
+    return dict(bot=bot,
+                agent=agent,
+                otherQueries=otherQueries,
+                query=query,
+                searchLink=history_queries.Search().makeLink(query),
+                columns=bot.historyColumns,
+                prettyName=prettyName,
+                dayGrid=dayGrid,
+                prettyDate=lambda dt: prettyDate(dt, bot.birthdate),
+                prettyMatch=prettyMatch)
+
+
+def entryRow(bot, row: Dict) -> Tuple:
+    """(uri, created, creator, msg, row, parsed created) as the templates
+    want."""
+    if 'structuredInput' in row:
+        kvs = kvFromMongoList(row['structuredInput'])
+        words = englishInput(bot.config.conversions, kvs)
+        if words:
+            msg = '[si] %s' % words
+        else:
+            msg = str(kvs)
+    else:
+        msg = row['sioc:content']
+    return (bot.uriForDoc(row), row['dc:created'], row['dc:creator'], msg, row,
+            parse(row['dc:created']))
+
+
+JSONLD_CONTEXT = {
+    'sioc': 'http://rdfs.org/sioc/ns#',
+    'dc': 'http://purl.org/dc/terms/',
+    'db': str(DB),
+    'dc:creator': {
+        '@type': '@id'
+    },
+}
+
+
+class _DocEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return json.JSONEncoder.default(self, o)
+
+
+_encode = _DocEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+def exportDoc(bot, row: Dict, fmt: str) -> Dict:
+    row.pop('history', None)
+    if fmt == 'rdf':
+        # this could have been RDFA in the normal page result
+        del row['_id']
+        del row['created']
+    elif fmt == 'jsonld':
+        row['@id'] = bot.uriForDoc(row)
+        del row['_id']
+        if 'structuredInput' in row:
+            row['db:structuredInput'] = row.pop('structuredInput')
+    return row
+
+
+@implementer(IPushProducer)
+class Drain:
+    """registered as a transport's producer, so the transport tells us when
+    its write buffer is full. wait() fires once it has drained."""
+    def __init__(self):
+        self._paused: Optional[Deferred] = None
+        self.stopped = False  # the connection is gone
+
+    def pauseProducing(self):
+        if self._paused is None:
+            self._paused = Deferred()
+
+    def resumeProducing(self):
+        d, self._paused = self._paused, None
+        if d is not None:
+            d.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+    def wait(self) -> Deferred:
+        return self._paused if self._paused is not None else succeed(None)
+
+
 class DiaryBotRequest(FixRequestHandler):
+    _capture = None
+
+    def on_finish(self):
+        STATS.handlerTime[type(self).__name__] = self.request.request_time()
+
+    def respondFromCache(self, key: Hashable) -> bool:
+        """Sets an ETag for key, which must change whenever the page would.
+        Returns True if that already answered the request (304 or a cached
+        page); otherwise starts capturing writes for storeCapture."""
+        etag = '"%s"' % hashlib.sha1(repr(
+            (_startToken, key)).encode('utf8')).hexdigest()[:24]
+        self.set_header('Etag', etag)
+        if etag in self.request.headers.get('If-None-Match', ''):
+            self.set_status(304)
+            return True
+        hit = _pageCache.get(key)
+        if hit is not None:
+            self.set_header('Content-type', hit[0])
+            self.write(hit[1])
+            return True
+        self._capture = []
+        self._captureBytes = 0
+        return False
+
+    def storeCapture(self, key: Hashable) -> None:
+        if self._capture is not None:
+            _pageCache.put(key, self._headers.get('Content-Type', 'text/html'),
+                           ''.join(self._capture))
+            self._capture = None
+
+    def write(self, chunk):
+        if self._capture is not None:
+            self._captureBytes += len(chunk)
+            if (isinstance(chunk, str) and
+                    self._captureBytes <= _pageCache.maxPageBytes):
+                self._capture.append(chunk)
+            else:
+                self._capture = None  # not worth caching
+        FixRequestHandler.write(self, chunk)
+
+    def template(self, name: str) -> cyclone.template.Template:
+        """compiled once, unless we're running with --dev"""
+        if self.settings.reloadTemplates:
+            loader.reset()
+        return loader.load(name)
+
     def getAgent(self):
         if 'DIARYBOT_AGENT' in os.environ:
             return URIRef(os.environ['DIARYBOT_AGENT'])
@@ -76,18 +297,28 @@ class DiaryBotRequest(FixRequestHandler):
 
 
 class index(DiaryBotRequest):
+    @inlineCallbacks
     def get(self):
         self.set_header('Content-type', 'text/html')
 
         agent = self.getAgent()
+        bots = visibleBots(self.settings.bots, agent)
+        # statuses say 'n hours ago', so they go stale within a minute
+        key = ('index', agent, tuple((b.name, b.revision) for b in bots),
+               int(time.time() // 60))
+        if self.respondFromCache(key):
+            return
+        statuses = yield gatherResults(
+            [ensureDeferred(b.getStatus()) for b in bots])
 
-        loader.reset()
         self.write(
-            loader.load('index.html').generate(
-                bots=visibleBots(self.settings.bots, agent),
+            self.template('index.html').generate(
+                bots=bots,
+                status=dict(zip(bots, statuses)),
                 loginBar=getLoginBar(self.request),
                 json=json,
             ))
+        self.storeCapture(key)
 
 
 def makeHttps(uri):
@@ -115,145 +346,242 @@ class StructuredInput(DiaryBotRequest):
 
 
 class EditForm(DiaryBotRequest):
+    @inlineCallbacks
     def get(self, botName, docId):
         bot = self.settings.bots[botName]
         agent = self.getAgent()
-        row = getDoc(bot, agent, docId)
+        row = yield getDoc(bot, agent, docId)
 
         self.set_header('Content-type', 'text/html')
         self.write(
-            loader.load('editform.html').generate(
+            self.template('editform.html').generate(
                 uri=bot.uriForDoc(row),
                 botName=bot.name,
                 row=row,
+                pending=isPending(bot, docId),
                 created=row['dc:created'],
                 creator=row['dc:creator'],
                 content=row.get('sioc:content', ''),
                 loginBar=getLoginBar(self.request),
             ))
 
+    @inlineCallbacks
     def post(self, botName, docId):
         bot = self.settings.bots[botName]
+        if isPending(bot, docId):
+            raise cyclone.web.HTTPError(409, 'entry is still being saved')
 
         if self.get_argument('method', default=None) == 'DELETE':
-            self.delete(botName, docId)
+            yield self.delete(botName, docId)
         else:
             if self.get_argument('newTime'):
                 dt = parse(self.get_argument('newTime'))
-                bot.updateTime(self.getAgent(), docId, dt)
+                yield bot.updateTime(self.getAgent(), docId, dt)
 
             self.redirectToHistoryPage(bot)
 
+    @inlineCallbacks
     def delete(self, botName, docId):
         bot = self.settings.bots[botName]
-        bot.delete(self.getAgent(), docId)
+        if isPending(bot, docId):
+            raise cyclone.web.HTTPError(409, 'entry is still being saved')
+        yield bot.delete(self.getAgent(), docId)
         self.redirectToHistoryPage(bot)
 
 
 class history(DiaryBotRequest):
-    def writeRdf(self, rows):
-        # this could have been RDFA in the normal page result
-        for r in rows:
-            del r['_id']
-            del r['created']
-        self.set_header('Content-type', 'application/json')
-        self.write(json.dumps(rows))
+    exportBatch = 500
 
+    @inlineCallbacks
+    def writeExport(self, bot, query, fmt, before, beforeId, pageSize):
+        """streams docs as each batch arrives. fmt is 'rdf' (the old JSON
+        list), 'ndjson' or 'jsonld'. Queries with exportsEverything walk
+        all their pages; others export the page the html would show."""
+        contentType, opener, sep, closer = {
+            'rdf': ('application/json', '[', ',', ']'),
+            'ndjson': ('application/x-ndjson', '', '\n', '\n'),
+            'jsonld': ('application/ld+json',
+                       '{"@context":%s,"@graph":[' % _encode(JSONLD_CONTEXT),
+                       ',', ']}'),
+        }[fmt]
+        self.set_header('Content-type', contentType)
+        self.write(opener)
+        transport = self.request.connection.transport
+        drain = Drain()
+        transport.registerProducer(drain, True)
+        try:
+            first = True
+            while True:
+                batchSize = (self.exportBatch
+                             if query.exportsEverything else pageSize)
+                rows = yield bot.store.runQuery(query, before, batchSize,
+                                                beforeId)
+                out = []
+                for row in rows:
+                    out.append(_encode(exportDoc(bot, row, fmt)))
+                if out:
+                    self.write(('' if first else sep) + sep.join(out))
+                    self.flush()
+                    first = False
+                # don't fetch more than a slow client has room for
+                yield drain.wait()
+                if drain.stopped:
+                    # the client left; don't let get() cache a cut-off body
+                    self._capture = None
+                    return
+                if (not query.exportsEverything or
+                        len(rows) < query.pageSize(batchSize)):
+                    break
+                before, beforeId = history_queries.pageCursor(rows)
+        finally:
+            transport.unregisterProducer()
+        self.write(closer)
+
+    @inlineCallbacks
+    def allRows(self, bot, query, before, beforeId, pageSize):
+        """rows for the views that don't page (rcs, entriesOnly): every
+        page from the cursor on for exportsEverything queries, like
+        writeExport, otherwise the one page"""
+        out = []
+        while True:
+            batchSize = (self.exportBatch
+                         if query.exportsEverything else pageSize)
+            rows = yield bot.store.runQuery(query, before, batchSize,
+                                            beforeId)
+            out.extend(rows)
+            if (not query.exportsEverything or
+                    len(rows) < query.pageSize(batchSize)):
+                return out
+            before, beforeId = history_queries.pageCursor(rows)
+
+    @inlineCallbacks
     def get(self, botName, selection=None):
         agent = self.getAgent()
         bot = self.settings.bots[botName]
 
         bot.assertUserCanRead(agent)
 
-        queries = [
-            history_queries.OffsetTime(365, 'a year ago', '/yearAgo'),
-            history_queries.All(),
-            history_queries.Last150(),
-            history_queries.Latest(),
-            history_queries.Bedtimes(),
-        ]
+        queries = history_queries.standardQueries()
         queries.extend(bot.historyQueries)
 
-        for q in queries:
-            if q.suffix == selection:
-                rows = list(q.run(bot.mongo))
-                query = q
-                queries.remove(q)
-                break
+        if selection == history_queries.Search.suffix:
+            query = history_queries.Search(self.get_argument('q', ''),
+                                           int(self.get_argument('page', '0')))
         else:
-            raise ValueError('unknown query %s' % selection)
+            for q in queries:
+                if q.suffix == selection:
+                    query = q
+                    queries.remove(q)
+                    break
+            else:
+                raise ValueError('unknown query %s' % selection)
 
-        if self.get_argument('rdf', ''):
-            self.writeRdf(rows)
+        key = ('history', bot.name, bot.revision, agent, selection,
+               tuple(sorted((k, tuple(v))
+                            for k, v in self.request.arguments.items())),
+               query.cacheBucket())
+        if self.respondFromCache(key):
             return
+        yield self.renderPage(bot, agent, query, queries)
+        self.storeCapture(key)
 
-        entries = []
-        for row in rows:
-            if 'structuredInput' in row:
-                kvs = kvFromMongoList(row['structuredInput'])
-                words = englishInput(self.settings.configGraph, kvs)
-                if words:
-                    msg = '[si] %s' % words
-                else:
-                    msg = str(kvs)
-            else:
-                msg = row['sioc:content']
-            entries.append((bot.uriForDoc(row), row['dc:created'],
-                            row['dc:creator'], msg, row))
-
-        def prettyName(uri):
-            return _foafName.get(URIRef(uri), uri)
-
-        def prettyMatch(content, pat):
-            try:
-                return '1' if re.search(pat, content) else ''
-            except Exception:
-                return ''
-
-        def hourOfDay(iso, startHour=0):
-            dt = parse(iso)
-            hr = dt.hour + dt.minute / 60
-            return round((hr - startHour) % 24.0 + startHour, 2)
-
-        def dayGrid(startHour, numHours, plotHour, label):
-            cells = []
-            for hr in range(startHour, startHour + numHours):
-                hr = hr % 24
-                marker = ''
-                if hr <= plotHour < hr + 1:
-                    pct = (plotHour - hr) * 100
-                    marker = f'''
-                     <span class="marker"
-                           style="left: {pct}%">⮛ {label}</span>'''
-                cells.append(f'<span>{hr}{marker}</span>')
-            return f'<span class="dayGrid">{"".join(cells)}</span>'
-
-        d = dict(bot=bot,
-                 agent=agent,
-                 entries=entries,
-                 otherQueries=queries,
-                 query=query,
-                 prettyName=prettyName,
-                 hourOfDay=hourOfDay,
-                 dayGrid=dayGrid,
-                 prettyDate=lambda iso: prettyDate(iso, bot.birthdate),
-                 prettyMatch=prettyMatch,
-                 unixDate=lambda iso: parse(iso).strftime('%s'),
-                 loginBar=getLoginBar(self.request))
+    @inlineCallbacks
+    def renderPage(self, bot, agent, query, queries):
+        before = self.get_argument('before', '')
+        before = parse(before) if before else None
+        if before is not None and before.tzinfo is not None:
+            # mongo hands back naive utc, and the queries compare with that
+            before = before.astimezone(tz.tzutc()).replace(tzinfo=None)
+        beforeId = self.get_argument('beforeId', '')
+        beforeId = ObjectId(beforeId) if beforeId else None
+        pageSize = int(self.get_argument('n', '0')) or None
+
+        d = rowTemplateArgs(bot, query, queries, agent)
+
+        exportFormat = self.get_argument('format', '') or (
+            'rdf' if self.get_argument('rdf', '') else '')
+        if exportFormat:
+            yield self.writeExport(bot, query, exportFormat, before, beforeId,
+                                   pageSize)
+            return
 
-        if self.get_argument('rcs', ''):
+        streaming = not (self.get_argument('rcs', '') or
+                         self.get_argument('entriesOnly', ''))
+        if streaming:
+            # the page top doesn't depend on the rows, so send it right away
             self.set_header('Content-type', 'text/html')
+            self.write(self.template('historyhead.html').generate(**d))
+            self.flush()
+
+        if streaming:
+            rows = yield bot.store.runQuery(query, before, pageSize, beforeId)
+        else:
+            rows = yield self.allRows(bot, query, before, beforeId, pageSize)
+
+        entries = (entryRow(bot, row) for row in rows)
+
+        if self.get_argument('rcs', ''):
             import rcsreport
             importlib.reload(rcsreport)
-            rcsreport.output(entries, self.write)
+            if self.get_argument('rcs') == 'csv':
+                self.set_header('Content-type', 'text/csv')
+                rcsreport.outputCsv(list(entries), self.write)
+            else:
+                self.set_header('Content-type', 'text/html')
+                rcsreport.output(list(entries), self.write)
             return
 
-        self.set_header('Content-type', 'text/html')
+        if not streaming:
+            self.set_header('Content-type', 'text/html')
+            self.write(
+                self.template('diaryviewentries.html').generate(
+                    entries=list(entries), **d))
+            return
+
+        rowsTemplate = self.template('diaryviewrows.html')
+        while True:
+            chunk = list(itertools.islice(entries, self.chunkRows))
+            if not chunk:
+                break
+            self.write(rowsTemplate.generate(entries=chunk, **d))
+            self.flush()
+
+        olderLink = None
+        nextArgs = query.nextPageArgs(rows, pageSize)
+        if nextArgs is not None:
+            olderLink = '?' + urllib.parse.urlencode(nextArgs)
+        self.write(
+            self.template('historyfoot.html').generate(
+                olderLink=olderLink, loginBar=getLoginBar(self.request)))
+
+    chunkRows = 100
+
+
+class Events(cyclone.sse.SSEHandler):
+    """server-sent events for one bot: each save, delete or time change,
+    with the bot's new status line.
 
-        if self.get_argument('entriesOnly', ''):
-            self.write(loader.load('diaryviewentries.html').generate(**d))
+    SSEHandler has sent the headers by the time bind runs, so a reader
+    who can't see this bot just gets the connection closed."""
+    bot = None  # until bind has checked the reader
+
+    def bind(self, botName):
+        try:
+            bot = self.settings.bots[botName]
+            bot.assertUserCanRead(DiaryBotRequest.getAgent(self))
+        except (KeyError, ValueError) as e:
+            log.warning(f'events for {botName!r} refused: {e!r}')
+            self.request.connection.transport.loseConnection()
             return
-        self.write(loader.load('history.html').generate(**d))
+        self.bot = bot
+        bot.events.subscribe(bot.name, self.onEvent)
+
+    def unbind(self):
+        if self.bot is not None:
+            self.bot.events.unsubscribe(self.bot.name, self.onEvent)
+
+    def onEvent(self, event: Dict):
+        self.sendEvent(json.dumps(event), event=event['kind'])
 
 
 class IncomingChatHandler:
@@ -277,6 +605,35 @@ class IncomingChatHandler:
         yield self.chat.sendMsg(toBot, fromUser, 'saved %s' % uri)
 
 
+def setFoafNames(config: Config) -> None:
+    _foafName.clear()
+    for uri, name in config.foafNames.items():
+        _foafName[URIRef(uri)] = name
+
+
+def makeApp(bots, config: Config, reloadTemplates=False):
+    setFoafNames(config)
+
+    return cyclone.web.Application([
+        (r'/', index),
+        (r'/stats/?(.*)', StatsHandler, {
+            'serverName': 'diarybot'
+        }),
+        (r'/dist/(bundle\.js)', cyclone.web.StaticFileHandler, {
+            'path': 'dist'
+        }),
+        (r'/([^/]+)/message', message),
+        (r'/([^/]+)/structuredInput', StructuredInput),
+        (r'/([^/]+)/history(/[^/]+)?', history),
+        (r'/([^/]+)/events', Events),
+        (r'/([^/]+)/([^/]+)', EditForm),
+    ],
+                                   bots=bots,
+                                   config=config,
+                                   reloadTemplates=reloadTemplates,
+                                   debug=True)
+
+
 def main():
     arg = docopt.docopt("""
     Usage: diarybot2.py [options]
@@ -284,47 +641,54 @@ def main():
     -v                    Verbose
     --no-chat             Don't talk to slack at all
     --drew-bot            Limit to just drewp healthbot
+    --check-indexes       Log the queries that mongo can't answer from an index
+    --dev                 Reload templates on every request
     """)
     verboseLogging(arg['-v'])
 
-    configGraph = Graph()
-    configGraph.parse('bots-secret.n3', format='n3')
     if arg['--drew-bot']:
         os.environ['DIARYBOT_AGENT'] = 'http://bigasterisk.com/foaf.rdf#drewp'
-        for botSubj in configGraph.subjects(RDF.type, DB['DiaryBot']):
-            if botSubj != BOT['healthBot']:
-                print(f'remove {botSubj}')
-                configGraph.remove((botSubj, RDF.type, DB['DiaryBot']))
+
+    def pickBots(config: Config) -> Config:
+        if arg['--drew-bot']:
+            for botConfig in config.bots[:]:
+                if URIRef(botConfig['uri']) != BOT['healthBot']:
+                    print(f'remove {botConfig["uri"]}')
+                    config.bots.remove(botConfig)
+        return config
+
+    config = pickBots(loadConfig(CONFIG_PATH))
 
     ich = None
     if not arg['--no-chat']:
+        from chatinterface import ChatInterface  # slack, aiohttp, etc
         ich = IncomingChatHandler()
         chat = ChatInterface(ich.onMsg)
     else:
         chat = NoChat()
-    bots = makeBots(chat, configGraph)
+    bots = makeBots(chat, config, slack=not arg['--no-chat'])
     if ich:
         ich.lateInit(bots, chat)
 
-    for s, p, o in configGraph.triples((None, FOAF['name'], None)):
-        _foafName[s] = o
-
-    reactor.listenTCP(
-        9048,
-        cyclone.web.Application([
-            (r'/', index),
-            (r'/dist/(bundle\.js)', cyclone.web.StaticFileHandler, {
-                'path': 'dist'
-            }),
-            (r'/([^/]+)/message', message),
-            (r'/([^/]+)/structuredInput', StructuredInput),
-            (r'/([^/]+)/history(/[^/]+)?', history),
-            (r'/([^/]+)/([^/]+)', EditForm),
-        ],
-                                bots=bots,
-                                configGraph=configGraph,
-                                debug=True),
-        interface='::')
+    if arg['--check-indexes']:
+        for bot in bots.values():
+            queries = history_queries.standardQueries() + bot.historyQueries
+            ensureDeferred(bot.reportUncoveredQueries(queries)).addErrback(
+                log.error)
+
+    app = makeApp(bots, config, reloadTemplates=arg['--dev'])
+
+    def reloadConfig(config: Config) -> None:
+        config = pickBots(config)
+        bots.reconfigure(config)
+        setFoafNames(config)
+        app.settings['config'] = config
+        forgetPages()
+
+    watchConfig(CONFIG_PATH, config, reloadConfig)
+
+    startLagMonitor()
+    reactor.listenTCP(9048, app, interface='::')
     reactor.run()
 
 
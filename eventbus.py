@@ -0,0 +1,26 @@
+"""in-process pub/sub of diary changes, so web clients can get pushed
+updates instead of reloading pages."""
+import logging
+from typing import Callable, Dict, Set
+
+log = logging.getLogger('eventbus')
+
+Listener = Callable[[Dict], None]
+
+
+class EventBus:
+    def __init__(self):
+        self.listeners: Dict[str, Set[Listener]] = {}  # bot name : callbacks
+
+    def subscribe(self, botName: str, listener: Listener) -> None:
+        self.listeners.setdefault(botName, set()).add(listener)
+
+    def unsubscribe(self, botName: str, listener: Listener) -> None:
+        self.listeners.get(botName, set()).discard(listener)
+
+    def publish(self, botName: str, event: Dict) -> None:
+        for listener in list(self.listeners.get(botName, [])):
+            try:
+                listener(event)
+            except Exception:
+                log.exception(f'listener {listener} failed on {event}')
@@ -1,11 +1,49 @@
 import datetime
 import re
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+from dateutil import tz
+from dateutil.parser import parse
+from bson import ObjectId
 from pymongo.collection import Collection
 from pymongo.cursor import Cursor
 
+from rollups import dayOf, fieldNameToPred, rollupCollection
+
+BED_INPUT = [
+    "<http://bigasterisk.com/ns/diaryBot#activity>",
+    "<http://bigasterisk.com/ns/diaryBot#bed>"
+]
+
+
+def hourOfDay(iso: str, startHour=0) -> float:
+    dt = parse(iso)
+    hr = dt.hour + dt.minute / 60
+    return round((hr - startHour) % 24.0 + startHour, 2)
+
+
+def eventFields(doc: Dict) -> Dict:
+    """precomputed fields for indexed queries: eventKind (only if we
+    recognize one) and localHour, the hour of day of dc:created."""
+    out = {'localHour': hourOfDay(doc['dc:created'])}
+    if re.match('^bed$', doc.get('sioc:content', ''), re.I):
+        out['eventKind'] = 'bed'
+    elif any(list(pair) == BED_INPUT
+             for pair in doc.get('structuredInput', [])):
+        out['eventKind'] = 'bed'
+    return out
+
+
+def pageCursor(rows: List[Dict]) -> Tuple[datetime.datetime, ObjectId]:
+    """(before, beforeId) for the page after these rows"""
+    last = min(rows, key=lambda row: (row['created'], row['_id']))
+    return last['created'], last['_id']
+
 
 class Query(object):
     suffix = None
+    defaultPageSize = 0  # 0 means no limit
+    exportsEverything = False  # ?format= exports walk all pages
 
     def makeLink(self, currentQuery) -> str:
         levels = (currentQuery.suffix or '').count('/')
@@ -15,23 +53,73 @@ class Query(object):
         levels = (self.suffix or '').count('/')
         return '../' * (levels + 1)
 
+    def cacheBucket(self) -> Hashable:
+        """changes when results can change without any write, e.g. for
+        queries relative to now"""
+        return None
+
+    def pageSize(self, pageSize: Optional[int]) -> int:
+        return pageSize or self.defaultPageSize
+
+    def nextPageArgs(self, rows: List[Dict],
+                     pageSize: Optional[int]) -> Optional[Dict]:
+        """query args for the page after these rows, or None if this was
+        the last one"""
+        if not rows or len(rows) < self.pageSize(pageSize):
+            return None
+        before, beforeId = pageCursor(rows)
+        return {
+            'before': before.isoformat(),
+            'beforeId': str(beforeId),
+            'n': self.pageSize(pageSize)
+        }
+
+    def nonDeleted(self,
+                   before: Optional[datetime.datetime],
+                   beforeId: Optional[ObjectId] = None) -> Dict:
+        """mongo filter for live docs, older than the (before, beforeId)
+        page cursor if there is one. Docs can share a created time, so _id
+        breaks the tie; the queries sort on both."""
+        spec = {'deleted': {'$exists': False}}
+        if before is not None:
+            if beforeId is None:
+                spec['created'] = {'$lt': before}
+            else:
+                spec['$or'] = [{
+                    'created': {
+                        '$lt': before
+                    }
+                }, {
+                    'created': before,
+                    '_id': {
+                        '$lt': beforeId
+                    }
+                }]
+        return spec
+
 
 class OffsetTime(Query):
+    defaultPageSize = 10
+
     def __init__(self, daysAgo: int, labelAgo: str, urlSuffix: str):
         self.name = self.desc = labelAgo
         self.daysAgo = daysAgo
         self.suffix = urlSuffix
 
-    def run(self, mongo: Collection) -> Cursor:
+    def cacheBucket(self) -> Hashable:
+        return int(time.time() // 600)
+
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> Cursor:
         end = datetime.datetime.now() - datetime.timedelta(days=self.daysAgo)
-        rows = mongo.find({
-            'deleted': {
-                '$exists': False
-            },
-            'created': {
-                '$lt': end
-            }
-        }).sort('created', -1).limit(10)
+        if before is None or end < before:
+            before, beforeId = end, None
+        rows = mongo.find(self.nonDeleted(before, beforeId),
+                          sort=[('created', -1), ('_id', -1)],
+                          limit=self.pageSize(pageSize))
         rows = reversed(list(rows))
         return rows
 
@@ -40,52 +128,193 @@ class Last150(Query):
     name = 'last 150 entries'
     desc = name
     suffix = '/recent'
+    defaultPageSize = 150
 
-    def run(self, mongo: Collection) -> Cursor:
-        return mongo.find({'deleted': {
-            '$exists': False
-        }},
-                          limit=150,
-                          sort=[('created', -1)])
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> Cursor:
+        return mongo.find(self.nonDeleted(before, beforeId),
+                          limit=self.pageSize(pageSize),
+                          sort=[('created', -1), ('_id', -1)])
 
 class Bedtimes(Query):
     name = 'bedtimes'
     desc = name
     suffix = '/bedtimes'
+    defaultPageSize = 300
 
-    def run(self, mongo: Collection) -> Cursor:
-        return mongo.find({
-            'deleted': {'$exists': False},
-            '$or': [
-                {'sioc:content':
-                 re.compile('^bed$', re.I)},
-                {'structuredInput': [
-                    "<http://bigasterisk.com/ns/diaryBot#activity>",
-                    "<http://bigasterisk.com/ns/diaryBot#bed>"
-                    ]},
-            ]
-        },
-                          limit=300,
-                          sort=[('created', -1)])
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> Cursor:
+        spec = self.nonDeleted(before, beforeId)
+        spec['eventKind'] = 'bed'
+        return mongo.find(spec,
+                          limit=self.pageSize(pageSize),
+                          sort=[('created', -1), ('_id', -1)])
 
 
 class Latest(Query):
     name = 'latest entry'
     desc = name
     suffix = '/latest'
+    defaultPageSize = 1
 
-    def run(self, mongo: Collection) -> Cursor:
-        return mongo.find({'deleted': {
-            '$exists': False
-        }},
-                          limit=1,
-                          sort=[('created', -1)])
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> Cursor:
+        return mongo.find(self.nonDeleted(before, beforeId),
+                          limit=self.pageSize(pageSize),
+                          sort=[('created', -1), ('_id', -1)])
 
 
 class All(Query):
     name = 'all'
     desc = 'history'
     suffix = None
+    defaultPageSize = 500
+    exportsEverything = True
+
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> Cursor:
+        return mongo.find(self.nonDeleted(before, beforeId)).sort([
+            ('created', -1), ('_id', -1)
+        ]).limit(self.pageSize(pageSize))
+
+
+class Search(Query):
+    """entries matching words in q, best matches first, from the text index
+    on sioc:content and searchText"""
+    name = 'search'
+    suffix = '/search'
+    defaultPageSize = 50
+
+    def __init__(self, q: str = '', page: int = 0):
+        self.q = q
+        self.page = page
+        self.desc = 'search for %r' % q
+
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> Cursor:
+        if not self.q.strip():
+            return []
+        spec = self.nonDeleted(None)  # ranked, so pages go by number
+        spec['$text'] = {'$search': self.q}
+        score = {'$meta': 'textScore'}
+        return mongo.find(spec,
+                          projection={'score': score},
+                          sort=[('score', score), ('created', -1)],
+                          skip=self.page * self.pageSize(pageSize),
+                          limit=self.pageSize(pageSize))
+
+    def nextPageArgs(self, rows: List[Dict],
+                     pageSize: Optional[int]) -> Optional[Dict]:
+        if len(rows) < self.pageSize(pageSize):
+            return None
+        return {'q': self.q, 'page': self.page + 1, 'n': self.pageSize(pageSize)}
+
+
+class DailySummary(Query):
+    """one row per day, from the rollups, so a year costs ~365 docs"""
+    name = 'daily summary'
+    desc = name
+    suffix = '/daily'
+    defaultPageSize = 366
+
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> List[Dict]:
+        spec = {}
+        if before is not None:
+            spec['_id'] = {'$lt': dayOf(before)}
+        return [
+            summaryRow(r['_id'], r)
+            for r in rollupCollection(mongo).find(
+                spec, sort=[('_id', -1)], limit=self.pageSize(pageSize))
+        ]
+
+
+class MonthlySummary(Query):
+    """daily rollups added up by month"""
+    name = 'monthly summary'
+    desc = name
+    suffix = '/monthly'
+    defaultPageSize = 120
+
+    def run(self,
+            mongo: Collection,
+            before: Optional[datetime.datetime] = None,
+            pageSize: Optional[int] = None,
+            beforeId: Optional[ObjectId] = None) -> List[Dict]:
+        months: Dict[str, Dict] = {}
+        spec = {}
+        if before is not None:
+            spec['_id'] = {'$lt': dayOf(before)}
+        for r in rollupCollection(mongo).find(spec, sort=[('_id', -1)]):
+            month = r['_id'][:7]
+            if month not in months:
+                if len(months) >= self.pageSize(pageSize):
+                    break
+                months[month] = {
+                    'count': 0,
+                    'tally': {},
+                    'firstCreated': r['firstCreated'],
+                    'lastCreated': r['lastCreated'],
+                    'lastId': r['lastId'],
+                }
+            m = months[month]
+            m['count'] += r['count']
+            m['firstCreated'] = min(m['firstCreated'], r['firstCreated'])
+            for p, n in r.get('tally', {}).items():
+                m['tally'][p] = m['tally'].get(p, 0) + n
+        return [summaryRow(month, m) for month, m in months.items()]
+
+
+def summaryRow(label: str, rollup: Dict) -> Dict:
+    """a rollup dressed as an entry doc, so the history templates can show
+    it. Links go to the period's last entry."""
+    first = rollup['firstCreated'].replace(tzinfo=tz.tzutc()).astimezone(
+        tz.tzlocal())
+    last = rollup['lastCreated'].replace(tzinfo=tz.tzutc()).astimezone(
+        tz.tzlocal())
+    tallies = ', '.join(
+        '%s×%s' % (re.split('[/#]', fieldNameToPred(p).strip('<>'))[-1], n)
+        for p, n in sorted(rollup.get('tally', {}).items()))
+    content = '%s: %s entries, %s to %s' % (label, rollup['count'],
+                                             first.strftime('%H:%M'),
+                                             last.strftime('%H:%M'))
+    if tallies:
+        content += '; ' + tallies
+    return {
+        '_id': rollup['lastId'],
+        'dc:created': first.isoformat(),
+        'dc:creator': '',
+        'created': rollup['firstCreated'],
+        'sioc:content': content,
+    }
+
 
-    def run(self, mongo: Collection) -> Cursor:
-        return mongo.find({'deleted': {'$exists': False}}).sort('created', -1)
+def standardQueries():
+    """the views every bot has, besides its configured historyQuery ones"""
+    return [
+        OffsetTime(365, 'a year ago', '/yearAgo'),
+        All(),
+        Last150(),
+        Latest(),
+        Bedtimes(),
+        DailySummary(),
+        MonthlySummary(),
+    ]
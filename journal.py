@@ -0,0 +1,158 @@
+"""write-ahead journal for new docs.
+
+Bot._save appends each new doc here (fsync'd) and returns; a flusher moves
+batches into mongo in the background. If mongo is slow, saves don't wait
+for it, and if it's down (or we restart) the docs are still in the file
+and get inserted later. Replays are safe because docs carry their _id
+from the start and duplicate inserts are ignored, so whatever else has to
+follow an insert (like rollups) goes in the idempotent onInserted hook.
+"""
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bson import json_util
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+
+from storage import botCollection, mongoPool
+
+log = logging.getLogger('journal')
+
+DUPLICATE_KEY = 11000
+
+
+class Journal:
+    def __init__(self,
+                 path=None,
+                 batchSize=100,
+                 retrySecs=5,
+                 onFlushed: Callable[[str], None] = lambda collName: None,
+                 onInserted: Callable[[Collection, List[Dict]],
+                                      None] = lambda coll, docs: None,
+                 inline=False):
+        """path defaults to $DIARYBOT_JOURNAL, then ./diarybot-journal.ndjson
+        (which should be on a volume that outlives the container). Only
+        one process should have a given file open.
+        onInserted(coll, docs) runs on the mongo pool after each insert,
+        including replays; if it fails, the batch is retried.
+        onFlushed(collName) is called when new docs land in that
+        collection.
+
+        inline=True is for scripts with no reactor running: append
+        inserts right away in the caller's thread, and there's no retry
+        timer, so a failed insert is retried on the next append or by the
+        next Journal that opens the file."""
+        self.path = path or os.environ.get('DIARYBOT_JOURNAL',
+                                           'diarybot-journal.ndjson')
+        self.batchSize = batchSize
+        self.onFlushed = onFlushed
+        self.onInserted = onInserted
+        self.inline = inline
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.pending: List[Tuple[str, Dict]] = self._read()
+        if self.pending:
+            log.info(f'replaying {len(self.pending)} journaled docs')
+        self.f = open(self.path, 'a')
+        self._flushing: Optional[Deferred] = None
+
+        if inline:
+            self.flush()
+            return
+        self.loop = LoopingCall(self.flush)
+        self.loop.start(retrySecs, now=True)
+
+    def _read(self) -> List[Tuple[str, Dict]]:
+        if not os.path.exists(self.path):
+            return []
+        out = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    rec = json_util.loads(line)
+                except ValueError:
+                    log.warning(f'skipping torn journal line {line!r}')
+                    continue
+                out.append((rec['coll'], rec['doc']))
+        return out
+
+    def append(self, collName: str, doc: Dict) -> None:
+        """doc must already have its _id. Durable when this returns."""
+        self.f.write(json_util.dumps({'coll': collName, 'doc': doc}) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending.append((collName, doc))
+        self._flushSoon()
+
+    def _flushSoon(self) -> None:
+        if self.inline:
+            self.flush()
+            return
+        from twisted.internet import reactor
+        reactor.callLater(0, self.flush)
+
+    def pendingDoc(self, collName: str, docId) -> Optional[Dict]:
+        """a doc that's saved but not in mongo yet"""
+        for c, doc in self.pending:
+            if c == collName and doc['_id'] == docId:
+                return doc
+        return None
+
+    def flush(self) -> Deferred:
+        if self._flushing is not None or not self.pending:
+            return succeed(None)
+        batch = self.pending[:self.batchSize]
+        if self.inline:
+            d = maybeDeferred(self._insert, batch)
+        else:
+            from twisted.internet import reactor
+            d = deferToThreadPool(reactor, mongoPool(), self._insert, batch)
+        self._flushing = d
+
+        def done(_):
+            self._flushing = None
+            del self.pending[:len(batch)]
+            self._rewrite()
+            for collName in set(c for c, doc in batch):
+                self.onFlushed(collName)
+            if self.pending:
+                self._flushSoon()
+
+        def failed(err):
+            self._flushing = None
+            log.error(f'journal flush failed, will retry: '
+                      f'{err.getErrorMessage()}')
+
+        d.addCallbacks(done, failed)
+        return d
+
+    def _insert(self, batch: List[Tuple[str, Dict]]) -> None:
+        byColl: Dict[str, List[Dict]] = {}
+        for collName, doc in batch:
+            byColl.setdefault(collName, []).append(doc)
+        for collName, docs in byColl.items():
+            coll = botCollection(collName)
+            try:
+                coll.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                errs = e.details.get('writeErrors', [])
+                if any(err['code'] != DUPLICATE_KEY for err in errs):
+                    raise
+                # the rest were already inserted by an earlier attempt
+            self.onInserted(coll, docs)
+
+    def _rewrite(self) -> None:
+        """shrink the file to just the docs still pending"""
+        self.f.close()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for collName, doc in self.pending:
+                f.write(json_util.dumps({'coll': collName, 'doc': doc}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.f = open(self.path, 'a')
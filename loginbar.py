@@ -1,8 +1,16 @@
+import os
+
 import requests
 
+# $DIARYBOT_LOGIN_BAR overrides; set it empty for no login bar
+LOGIN_BAR_URL = os.environ.get('DIARYBOT_LOGIN_BAR',
+                               'http://bang5:9023/_loginBar')
+
 
 def getLoginBar(request):
-    return requests.get('http://bang5:9023/_loginBar',
+    if not LOGIN_BAR_URL:
+        return ''
+    return requests.get(LOGIN_BAR_URL,
                         headers={
                             'Cookie':
                             request.headers.get('cookie', ''),
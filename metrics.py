@@ -0,0 +1,37 @@
+"""runtime measurements, browsable at /stats (add ?format=json for json).
+
+Timings are in seconds. Each PmfStat entry keeps a count, and its
+percentiles refresh at most every 20 seconds.
+"""
+import time
+
+from greplin import scales
+from twisted.internet.task import LoopingCall
+
+STATS = scales.collection(
+    '/root',
+    scales.NamedPmfDictStat('handlerTime'),  # handler class : request time
+    scales.NamedPmfDictStat('queryTime'),  # history query name : mongo time
+    scales.NamedPmfDictStat('queryRows'),  # history query name : rows
+    scales.NamedPmfDictStat('slackTime'),  # slack method : call time
+    scales.IntDictStat('slackCalls'),  # slack method : calls
+    scales.IntDictStat('slackErrors'),  # slack method : failed calls
+    scales.StringDictStat('nextNag'),  # bot name : iso time, or ''
+    scales.IntDictStat('nagsSent'),  # bot name : count
+    scales.PmfStat('reactorLag'),  # how late a 1s timer fires
+)
+
+lagInterval = 1
+
+
+def startLagMonitor() -> None:
+    """a timer that should fire every lagInterval; whatever extra time it
+    takes is time the reactor spent stuck in something else"""
+    last = [time.time()]
+
+    def tick():
+        now = time.time()
+        STATS.reactorLag = max(0, now - last[0] - lagInterval)
+        last[0] = now
+
+    LoopingCall(tick).start(lagInterval, now=False)
@@ -0,0 +1,22 @@
+"""the chat API with no chat service behind it, for --no-chat. Doesn't
+import slack or aiohttp."""
+from typing import Any
+
+from rdflib import URIRef
+from twisted.internet import defer
+from twisted.internet.defer import Deferred
+
+BotType = Any
+
+
+class NoChat:
+    def initBot(self, bot: BotType, token: str) -> Deferred:
+        return defer.succeed(None)
+    def removeBot(self, bot: BotType) -> None:
+        pass
+    def sendMsg(self, bot: BotType, toUser: URIRef, msg: str) -> Deferred:
+        return defer.succeed(None)
+    async def userIsOnline(self, user: URIRef):
+        return False
+    def anyClient(self):
+        raise ValueError("no chat")
@@ -0,0 +1,88 @@
+"""notifications to owners, delivered off the save path.
+
+Bot._save only enqueues; a few workers deliver concurrently, by chat if the
+owner is online, otherwise through the email gateway over a shared
+keep-alive HTTP pool. Each attempt has a timeout and failures are retried.
+"""
+import logging
+import urllib.parse
+from io import BytesIO
+from typing import Any, Tuple
+
+from rdflib import URIRef
+from twisted.internet.defer import Deferred, DeferredQueue, ensureDeferred
+from twisted.internet.task import deferLater
+from twisted.web.client import (Agent, FileBodyProducer, HTTPConnectionPool,
+                                readBody)
+from twisted.web.http_headers import Headers
+
+log = logging.getLogger('outbox')
+
+EMAIL_GATEWAY = b'http://bang5:9040/'
+
+
+def withTimeout(d: Deferred, secs: float) -> Deferred:
+    from twisted.internet import reactor
+    return d.addTimeout(secs, reactor)
+
+
+class Outbox:
+    def __init__(self, chat, workers=4, timeout=10, retries=3):
+        from twisted.internet import reactor
+        self.chat = chat
+        self.timeout = timeout
+        self.retries = retries
+        self.queue: DeferredQueue = DeferredQueue()
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = workers
+        self.agent = Agent(reactor, connectTimeout=timeout, pool=self.pool)
+        for _ in range(workers):
+            ensureDeferred(self._worker())
+
+    def send(self, bot: Any, toUser: URIRef, msg: str) -> None:
+        self.queue.put((bot, toUser, msg))
+
+    async def _worker(self):
+        while True:
+            item: Tuple = await self.queue.get()
+            try:
+                await self._deliverWithRetries(*item)
+            except Exception as e:
+                log.error(f'giving up on notification {item!r}: {e!r}')
+
+    async def _deliverWithRetries(self, bot, toUser: URIRef, msg: str):
+        for attempt in range(self.retries):
+            try:
+                await self._deliver(bot, toUser, msg)
+                return
+            except Exception as e:
+                if attempt == self.retries - 1:
+                    raise
+                delay = 2**attempt
+                log.warning(f'notify {toUser} failed ({e!r}); '
+                            f'retry in {delay}s')
+                from twisted.internet import reactor
+                await deferLater(reactor, delay, lambda: None)
+
+    async def _deliver(self, bot, toUser: URIRef, msg: str):
+        if await self.chat.userIsOnline(toUser):
+            await withTimeout(self.chat.sendMsg(bot, toUser, msg),
+                              self.timeout)
+        else:
+            await self._email(toUser, msg)
+
+    async def _email(self, toUser: URIRef, msg: str):
+        body = urllib.parse.urlencode({
+            'user': toUser,
+            'msg': msg,
+            'mode': 'email'
+        }).encode('utf8')
+        resp = await withTimeout(
+            self.agent.request(
+                b'POST', EMAIL_GATEWAY,
+                Headers({
+                    b'Content-Type': [b'application/x-www-form-urlencoded']
+                }), FileBodyProducer(BytesIO(body))), self.timeout)
+        await readBody(resp)  # frees the connection for the pool
+        if resp.code >= 300:
+            raise ValueError(f'email gateway returned {resp.code}')
@@ -1,69 +1,112 @@
-import datetime
-from dateutil.parser import parse
-
-
-def output(entries, write):
-    entries = entries[:]
-    entries.reverse()
-
-    snappedRows = {}
-    for uri, created, creator, msg, row in entries:
-        t = parse(created)
-        if 15 < t.minute < 45:
-            snap = t.replace(minute=30, second=0, microsecond=0)
-        else:
-            minute = t.minute
-            snap = t.replace(minute=0, second=0, microsecond=0)
-            if minute > 30:
-                snap = snap + datetime.timedelta(hours=1)
-        snappedRows.setdefault(snap, []).append((t, msg, row))
+import csv
+import io
 
+import numpy
+
+HEADERS = [
+    'study date', 'study time', '', 'diary record time', '0=asleep, 1=awake',
+    '0=off, 1=on', '1=working hours', '', '1=non-troublesome dyskinesia',
+    '1=troublesome dyskinesia', '1=non-troublesome tremor',
+    '1=troublesome tremor', 'med taken', 'raw input'
+]
+
+# messages that set a state flag on their half hour
+STATE_BITS = {'on': 1, 'nttr': 2, 'trtr': 4, 'ok': 8, 'ntdys': 16}
+ON, NTTR, TRTR, OK, NTDYS = 1, 2, 4, 8, 16
+
+STEP = 1800  # seconds per table row
+
+
+def _flagColumn(flags: numpy.ndarray, bits: int) -> numpy.ndarray:
+    """1 where any of bits is set, 0 where some other state word was
+    seen, '' where none were."""
+    return numpy.where(flags & bits, '1', numpy.where(flags, '0', ''))
+
+
+def table(entries):
+    """yields header then row lists. entries are history's
+    (uri, created, creator, msg, row, dt) tuples, newest first."""
+    yield HEADERS
+    entries = entries[::-1]
+    if not entries:
+        return
+    times = [e[5] for e in entries]
+    msgs = [e[3] for e in entries]
+
+    epoch = numpy.array([t.timestamp() for t in times])
+    minute = numpy.array([t.minute for t in times])
+    subMinute = numpy.array([t.second + t.microsecond / 1e6 for t in times])
+    hourStart = epoch - minute * 60 - subMinute
+    # :16-:44 goes to :30, earlier to :00, later to the next hour
+    snap = numpy.where((minute > 15) & (minute < 45), hourStart + 1800,
+                       numpy.where(minute > 30, hourStart + 3600, hourStart))
+
+    start = hourStart[0] + (0 if minute[0] < 30 else 1800)
+    numRows = max(0, int((epoch[-1] - start) // STEP) + 1)
+
+    # table row i (from 0) is at start + STEP * (i + 1)
+    steps = (snap - start) / STEP
+    rowIndex = numpy.rint(steps).astype(int) - 1
+    inTable = ((numpy.abs(steps - numpy.rint(steps)) < 1e-6) &
+               (rowIndex >= 0) & (rowIndex < numRows))
+
+    bits = numpy.array([STATE_BITS.get(m.lower(), 0) for m in msgs])
+    flags = numpy.zeros(numRows, dtype=int)
+    numpy.bitwise_or.at(flags, rowIndex[inTable], bits[inTable])
+
+    # rows are shown in the first entry's utc offset
+    offset = times[0].utcoffset().total_seconds() if times[0].utcoffset(
+    ) else 0
+    rowTimes = (start + offset + STEP * numpy.arange(1, numRows + 1)).astype(
+        'datetime64[s]')
+    stamps = numpy.datetime_as_string(rowTimes, unit='m')
+
+    onOff = _flagColumn(flags, ON | OK)
+    ntdys = _flagColumn(flags, NTDYS)
+    trdys = _flagColumn(flags, 0)
+    nttr = _flagColumn(flags, NTTR)
+    trtr = _flagColumn(flags, TRTR)
+
+    matches = {}  # row index : entry indices, oldest first
+    for i in numpy.nonzero(inTable)[0]:
+        matches.setdefault(rowIndex[i], []).append(i)
+
+    for r in range(numRows):
+        recordTime = meds = raw = ''
+        if r in matches:
+            m = matches[r]
+            recordTime = times[m[0]].strftime('%Y-%m-%d %a %H:%M')
+            meds = '; '.join(msgs[i] for i in m if msgs[i].startswith('[si]'))
+            raw = '; '.join('%s %s' % (times[i].strftime('%H:%M'), msgs[i])
+                            for i in m if not msgs[i].startswith('[si]'))
+        day, hm = stamps[r].split('T')
+        yield [
+            day, hm, '', recordTime, '?', onOff[r], '', '', ntdys[r],
+            trdys[r], nttr[r], trtr[r], meds, raw
+        ]
+
+
+def output(entries, write, chunkRows=500):
+    rows = table(entries)
     write('<table>')
-    write('<tr>')
-    write(''.join('<th>%s</th>' % h for h in [
-        'study date', 'study time', '', 'diary record time',
-        '0=asleep, 1=awake', '0=off, 1=on', '1=working hours', '',
-        '1=non-troublesome dyskinesia', '1=troublesome dyskinesia',
-        '1=non-troublesome tremor', '1=troublesome tremor', 'med taken',
-        'raw input'
-    ]))
-    write('</tr>')
-    t = parse(entries[0][1])
-    t = t.replace(minute=0 if t.minute < 30 else 30, second=0, microsecond=0)
-    endTime = parse(entries[-1][1])
-
-    def writeTd(s):
-        return write('<td>%s</td>' % s)
-
-    while t <= endTime:
-        t = t + datetime.timedelta(minutes=30)
-        write('<tr>')
-        writeTd(t.date().isoformat())
-        writeTd(t.time().strftime('%H:%M'))
-        writeTd('')
-
-        matchRows = snappedRows.get(t, [])
-
-        stateWords = set()
-        for msg in [r[1] for r in matchRows]:
-            if msg.lower() in ['on', 'nttr', 'trtr', 'ok', 'ntdys']:
-                stateWords.add(msg.lower())
-
-        writeTd(''.join(
-            [r[0].strftime('%Y-%m-%d %a %H:%M') for r in matchRows[:1]]))
-
-        writeTd('?')  # awake
-        writeTd((1 if ('on' in stateWords or 'ok' in stateWords) else
-                 (0 if stateWords else '')))
-        writeTd('')  # working
-        writeTd('')  # spacer
-        writeTd((1 if 'ntdys' in stateWords else (0 if stateWords else '')))
-        writeTd((1 if 'trdys' in stateWords else (0 if stateWords else '')))
-        writeTd((1 if 'nttr' in stateWords else (0 if stateWords else '')))
-        writeTd((1 if 'trtr' in stateWords else (0 if stateWords else '')))
-        writeTd('; '.join(r[1] for r in matchRows if r[1].startswith('[si]')))
-        writeTd('; '.join('%s %s' % (r[0].strftime('%H:%M'), r[1])
-                          for r in matchRows if not r[1].startswith('[si]')))
-
-        write('</tr>')
+    write('<tr>%s</tr>' % ''.join('<th>%s</th>' % h for h in next(rows)))
+    chunk = []
+    for row in rows:
+        chunk.append('<tr>%s</tr>' % ''.join('<td>%s</td>' % c for c in row))
+        if len(chunk) >= chunkRows:
+            write(''.join(chunk))
+            chunk = []
+    write(''.join(chunk))
     write('</table>')
+
+
+def outputCsv(entries, write, chunkRows=500):
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    for i, row in enumerate(table(entries)):
+        out.writerow(row)
+        if i % chunkRows == 0:
+            write(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+    write(buf.getvalue())
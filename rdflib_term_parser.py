@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 from rdflib.plugins.parsers.ntriples import ParseError, unquote, URI, r_uriref, uriquote, r_literal, Literal
 from rdflib.term import Node
 
@@ -47,6 +50,20 @@ class TermParser(object):
         return False
 
 
-def parseN3Term(n: str) -> Node:
+def _parseN3TermSlow(n: str) -> Node:
     p = TermParser(n)
     return p.uriref() or p.literal()
+
+
+# a whole <uri> that unquote would leave alone
+_plainUri = re.compile(r'<([^:\\\s"<>]+:[^\\\s"<>]*)>$')
+
+
+@lru_cache(maxsize=4096)
+def parseN3Term(n: str) -> Node:
+    """The structured-input vocabulary is small, so this is nearly always a
+    cache hit, and the same string always gives the same term object."""
+    m = _plainUri.match(n)
+    if m:
+        return URI(m.group(1))
+    return _parseN3TermSlow(n)
@@ -0,0 +1,8 @@
+"""Import this before anything else imports twisted.internet.reactor, to
+make twisted's global reactor the asyncio one (which slack-sansio needs).
+It's only asyncio, so it's cheap even when chat is off."""
+import asyncio
+
+from twisted.internet import asyncioreactor
+
+asyncioreactor.install(asyncio.get_event_loop())
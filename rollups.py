@@ -0,0 +1,137 @@
+#!/usr/bin/python
+"""per-day summaries of each bot's entries, for long-range views.
+
+They live in the bot's '<name>.rollup' subcollection, one doc per local
+day:
+  {_id: '2020-01-31', count, firstCreated, lastCreated, lastId,
+   tally: {<escaped predicate n3>: count}}
+Saves (once the journal gets them into mongo), deletes and time changes
+recompute the days they touch. Run this file to rebuild them all from the
+raw docs.
+"""
+import datetime
+import logging
+from typing import Dict, Iterable, Optional
+
+from dateutil import tz
+from pymongo import ReplaceOne
+from pymongo.collection import Collection
+
+log = logging.getLogger('rollups')
+
+
+def rollupCollection(coll: Collection) -> Collection:
+    return coll['rollup']
+
+
+def dayOf(created: datetime.datetime) -> str:
+    """local day of a mongo 'created' (naive values are utc)"""
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=tz.tzutc())
+    return created.astimezone(tz.tzlocal()).date().isoformat()
+
+
+def _fieldName(s: str) -> str:
+    return s.replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+
+def fieldNameToPred(s: str) -> str:
+    return s.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+
+def _preds(doc: Dict) -> Iterable[str]:
+    return (_fieldName(k) for k, v in doc.get('structuredInput', []))
+
+
+def _dayRange(day: str):
+    start = datetime.datetime.strptime(day, '%Y-%m-%d').replace(
+        tzinfo=tz.tzlocal())
+    end = start + datetime.timedelta(days=1)
+    return start.astimezone(tz.tzutc()), end.astimezone(tz.tzutc())
+
+
+def _summarize(docs: Iterable[Dict]) -> Optional[Dict]:
+    out = None
+    for doc in docs:
+        if out is None:
+            out = {'count': 0, 'tally': {}, 'firstCreated': doc['created']}
+        out['count'] += 1
+        out['lastCreated'] = doc['created']
+        out['lastId'] = max(out.get('lastId', doc['_id']), doc['_id'])
+        for p in _preds(doc):
+            out['tally'][p] = out['tally'].get(p, 0) + 1
+    return out
+
+
+def rebuildDays(coll: Collection, days: Iterable[str]) -> None:
+    for day in set(days):
+        start, end = _dayRange(day)
+        summary = _summarize(
+            coll.find(
+                {
+                    'deleted': {
+                        '$exists': False
+                    },
+                    'created': {
+                        '$gte': start,
+                        '$lt': end
+                    }
+                },
+                projection=['created', 'structuredInput'],
+                sort=[('created', 1)]))
+        if summary is None:
+            rollupCollection(coll).delete_one({'_id': day})
+        else:
+            summary['_id'] = day
+            rollupCollection(coll).replace_one({'_id': day},
+                                               summary,
+                                               upsert=True)
+
+
+def rebuildAll(coll: Collection) -> int:
+    """streams the raw docs once, oldest first. Returns days written."""
+    writes = []
+    days = []
+    dayDocs = []
+    currentDay = None
+
+    def finishDay():
+        if dayDocs:
+            summary = _summarize(dayDocs)
+            summary['_id'] = currentDay
+            days.append(currentDay)
+            writes.append(ReplaceOne({'_id': currentDay}, summary,
+                                     upsert=True))
+
+    for doc in coll.find({'deleted': {
+            '$exists': False
+    }},
+                         projection=['created', 'structuredInput'],
+                         sort=[('created', 1)]):
+        day = dayOf(doc['created'])
+        if day != currentDay:
+            finishDay()
+            currentDay, dayDocs = day, []
+        dayDocs.append(doc)
+    finishDay()
+
+    rollups = rollupCollection(coll)
+    rollups.delete_many({'_id': {'$nin': days}})
+    if writes:
+        rollups.bulk_write(writes, ordered=False)
+    return len(writes)
+
+
+def main():
+    from storage import configureMongo, diaryDb
+    logging.basicConfig(level=logging.INFO)
+    configureMongo()
+    db = diaryDb()
+    for botName in db.list_collection_names():
+        if '.' in botName or botName.startswith('system'):
+            continue
+        log.info('%s: rebuilt %s days', botName, rebuildAll(db[botName]))
+
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,22 @@ class DiarybotEntry extends PolymerElement {
         };
     }
 
+    connectedCallback() {
+        super.connectedCallback();
+        this.events = new EventSource(`${this.botName}/events`);
+        const update = (ev) => {
+            this.status = JSON.parse(ev.data).status;
+        };
+        ['save', 'delete', 'updateTime'].forEach((kind) => {
+            this.events.addEventListener(kind, update);
+        });
+    }
+
+    disconnectedCallback() {
+        super.disconnectedCallback();
+        this.events.close();
+    }
+
     onResponse(ev) {
         if (ev.detail.status == 200) {
             this.shadowRoot.querySelector('precious-textarea').clear();
@@ -0,0 +1,223 @@
+"""mongo access that doesn't block the reactor.
+
+pymongo is synchronous, so every call here runs on a small shared
+threadpool and comes back as a Deferred. The reactor is only imported
+when that's used, so tools that just want mongoClient() don't install
+one (or pick which one the app gets).
+"""
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from rdflib import URIRef
+
+from metrics import STATS
+
+log = logging.getLogger('storage')
+
+_pool: Optional[ThreadPool] = None
+_client: Optional[MongoClient] = None
+_clientSettings = dict(host='bang5', port=27017, maxPoolSize=10)
+_dbName = 'diarybot'
+
+# Every bot collection gets these. They follow the query shapes in
+# history_queries and Bot: live docs newest-first, recent structured-input
+# docs, event kinds like Bedtimes, and words for Search. (A partial index
+# can't select deleted:{$exists:false}, so 'deleted' leads the compound key
+# instead.)
+INDEXES = [
+    IndexModel([('deleted', ASCENDING), ('created', DESCENDING),
+                ('_id', DESCENDING)],
+               name='live_by_created_id'),
+    IndexModel([('created', DESCENDING)],
+               name='structured_by_created',
+               partialFilterExpression={'structuredInput': {
+                   '$exists': True
+               }}),
+    IndexModel([('eventKind', ASCENDING), ('created', DESCENDING),
+                ('_id', DESCENDING)],
+               name='events_by_created_id',
+               partialFilterExpression={'eventKind': {
+                   '$exists': True
+               }}),
+    IndexModel([('sioc:content', TEXT), ('searchText', TEXT)],
+               name='words'),
+]
+# older versions of the above, dropped when they're still around
+OLD_INDEXES = ['live_by_created', 'events_by_created']
+
+
+def mongoPool() -> ThreadPool:
+    """bounded, so a pile of slow queries can't start unlimited threads."""
+    global _pool
+    if _pool is None:
+        from twisted.internet import reactor
+        _pool = ThreadPool(minthreads=1, maxthreads=4, name='mongo')
+        _pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _pool.stop)
+    return _pool
+
+
+def configureMongo(settings: Optional[Dict] = None) -> None:
+    """pick the shared client's host/port/pool size and the database name.
+    Environment (DIARYBOT_MONGO_HOST, DIARYBOT_MONGO_PORT,
+    DIARYBOT_MONGO_POOL, DIARYBOT_MONGO_DB) beats settings (the config
+    snapshot's host/port/maxPoolSize, from db:mongoHost/db:mongoPort/
+    db:mongoPoolSize), which beat the defaults. Has no effect once the
+    client exists."""
+    global _dbName
+    if _client is not None:
+        log.warning('mongo client already made; ignoring new settings')
+        return
+    _dbName = os.environ.get('DIARYBOT_MONGO_DB', _dbName)
+    for key, env, conv in [
+        ('host', 'DIARYBOT_MONGO_HOST', str),
+        ('port', 'DIARYBOT_MONGO_PORT', int),
+        ('maxPoolSize', 'DIARYBOT_MONGO_POOL', int),
+    ]:
+        if settings and key in settings:
+            _clientSettings[key] = conv(settings[key])
+        if env in os.environ:
+            _clientSettings[key] = conv(os.environ[env])
+
+
+def mongoClient() -> MongoClient:
+    """one client, so one socket pool and one set of monitor threads, for
+    all bots and tools in the process. It connects on first use."""
+    global _client
+    if _client is None:
+        log.info(f'mongo client for {_clientSettings}')
+        _client = MongoClient(connect=False, **_clientSettings)
+    return _client
+
+
+def uriForDoc(botName: str, doc: Dict) -> URIRef:
+    return URIRef('http://bigasterisk.com/diary/%s/%s' % (botName, doc['_id']))
+
+
+def diaryDb() -> Database:
+    return mongoClient()[_dbName]
+
+
+def botCollection(botName: str) -> Collection:
+    return diaryDb()[botName]
+
+
+class MongoStore:
+    """one bot's collection. Public methods return Deferreds.
+
+    inline=True runs each call right away in the caller's thread (the
+    Deferred has already fired), for scripts with no reactor running."""
+    def __init__(self, coll: Collection, inline=False):
+        self.coll = coll
+        self.inline = inline
+
+    def _run(self, f, *args, **kw) -> Deferred:
+        if self.inline:
+            return maybeDeferred(f, *args, **kw)
+        from twisted.internet import reactor
+        return deferToThreadPool(reactor, mongoPool(), f, *args, **kw)
+
+    def find(self, *args, **kw) -> Deferred:
+        """Deferred to a list of docs. Takes pymongo find args (filter,
+        projection, sort, limit)."""
+        return self._run(lambda: list(self.coll.find(*args, **kw)))
+
+    def findOne(self, *args, **kw) -> Deferred:
+        return self._run(self.coll.find_one, *args, **kw)
+
+    def insertOne(self, doc: Dict) -> Deferred:
+        """Deferred to the new _id."""
+        return self._run(lambda: self.coll.insert_one(doc).inserted_id)
+
+    def findOneAndUpdate(self, *args, **kw) -> Deferred:
+        return self._run(self.coll.find_one_and_update, *args, **kw)
+
+    def ensureIndexes(self) -> Deferred:
+        def go():
+            for name in set(OLD_INDEXES) & set(self.coll.index_information()):
+                self.coll.drop_index(name)
+            return self.coll.create_indexes(INDEXES)
+
+        return self._run(go)
+
+    def uncoveredFinds(self, run: Callable[[Collection], Any]) -> Deferred:
+        """Deferred to the list of find() filters issued by run(coll) that
+        mongo would answer with a collection scan."""
+        def go() -> List[Dict]:
+            rec = _FindRecorder(self.coll)
+            list(run(rec))
+            out = []
+            for spec, cursor in rec.finds:
+                # explain() reruns a clone, with whatever sort/limit run added
+                plan = cursor.explain()['queryPlanner']['winningPlan']
+                if 'COLLSCAN' in _planStages(plan):
+                    out.append(spec)
+            return out
+
+        return self._run(go)
+
+    def call(self, f: Callable[[Collection], Any]) -> Deferred:
+        """run f(coll) on the pool, for when one round trip isn't enough."""
+        return self._run(f, self.coll)
+
+    def runQuery(self, query, before=None, pageSize=None,
+                 beforeId=None) -> Deferred:
+        """Deferred to the list of rows from a history_queries.Query."""
+        def go() -> List[Dict]:
+            t1 = time.time()
+            rows = list(
+                query.run(self.coll,
+                          before=before,
+                          pageSize=pageSize,
+                          beforeId=beforeId))
+            STATS.queryTime[query.name] = time.time() - t1
+            STATS.queryRows[query.name] = len(rows)
+            return rows
+
+        return self._run(go)
+
+
+class _FindRecorder:
+    """stands in for a Collection and remembers the find() calls made on it"""
+    def __init__(self, coll: Collection):
+        self.coll = coll
+        self.finds = []  # (filter, cursor)
+
+    def find(self, *args, **kw):
+        cursor = self.coll.find(*args, **kw)
+        self.finds.append((args[0] if args else kw.get('filter'), cursor))
+        return cursor
+
+    def __getitem__(self, name: str) -> '_FindRecorder':
+        """subcollections (like rollups) record into the same list"""
+        sub = _FindRecorder(self.coll[name])
+        sub.finds = self.finds
+        return sub
+
+    def aggregate(self, pipeline, **kw):
+        """the leading $match (and $sort) is the part that can use an
+        index, so that's what we explain."""
+        if pipeline and '$match' in pipeline[0]:
+            spec = pipeline[0]['$match']
+            cursor = self.coll.find(spec)
+            if len(pipeline) > 1 and '$sort' in pipeline[1]:
+                cursor = cursor.sort(list(pipeline[1]['$sort'].items()))
+            self.finds.append((spec, cursor))
+        return self.coll.aggregate(pipeline, **kw)
+
+
+def _planStages(plan: Dict) -> Set[str]:
+    stages = {plan.get('stage')}
+    if 'inputStage' in plan:
+        stages.update(_planStages(plan['inputStage']))
+    for p in plan.get('inputStages', []):
+        stages.update(_planStages(p))
+    return stages
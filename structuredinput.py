@@ -1,6 +1,6 @@
 from rdflib import Literal, Namespace, RDFS, RDF, URIRef, Graph
 from rdflib.term import Node
-from typing import Dict, Set, List, Tuple, Any
+from typing import Dict, Set, List, Optional, Tuple, Any
 from rdflib_term_parser import parseN3Term
 
 SCHEMA = Namespace('http://schema.org/')
@@ -39,44 +39,81 @@ def structuredInputElementConfig(g: Graph, bot: URIRef) -> Dict:
     return config
 
 
-def englishInput(g: Graph, kvs: Dict[Node, Node]) -> str:
+def _n3OrNone(node: Optional[Node]) -> Optional[str]:
+    return None if node is None else node.n3()
+
+
+def _strOrNone(node: Optional[Node]) -> Optional[str]:
+    return None if node is None else str(node)
+
+
+def conversionRules(g: Graph) -> List[Dict]:
+    """the db:NaturalInputConversion rules in report order, with terms as
+    n3, for the config snapshot"""
     convs = []
     for conv in g.subjects(RDF.type, DB['NaturalInputConversion']):
-        convs.append({
-            'reportPred':
-            g.value(conv, DB['reportPred']),
-            'reportObj':
-            g.value(conv, DB['reportObj'], default=None),
-            'label':
-            g.value(conv, RDFS.label, default=None),
-            'prepend':
-            g.value(conv, DB['prepend'], default=None),
-            'reportOrder':
-            g.value(conv, DB['reportOrder'], default=Literal(0)),
-        })
-    convs.sort(key=lambda c: c['reportOrder'].toPython())
-
-    words = []
-    for conv in convs:
-        for k, v in kvs.items():
-            if k == conv['reportPred']:
+        convs.append((g.value(conv, DB['reportOrder'],
+                              default=Literal(0)).toPython(), {
+                                  'reportPred':
+                                  _n3OrNone(g.value(conv, DB['reportPred'])),
+                                  'reportObj':
+                                  _n3OrNone(g.value(conv, DB['reportObj'])),
+                                  'label':
+                                  _strOrNone(g.value(conv, RDFS.label)),
+                                  'prepend':
+                                  _strOrNone(g.value(conv, DB['prepend'])),
+                              }))
+    convs.sort(key=lambda c: c[0])
+    return [conv for order, conv in convs]
+
+
+class NaturalInputConversions:
+    """conversionRules output, indexed for english()"""
+    def __init__(self, rules: List[Dict], labels: Dict[str, str]):
+        """labels is uri : rdfs:label, for values that show as their
+        label"""
+        self.labels = labels
+
+        # reportPred : [(position in sorted order, conv)]
+        self.byPred: Dict[Node, List[Tuple[int, Dict]]] = {}
+        for i, rule in enumerate(rules):
+            conv = dict(rule)
+            for k in ['reportPred', 'reportObj']:
+                if conv[k] is not None:
+                    conv[k] = parseN3Term(conv[k])
+            self.byPred.setdefault(conv['reportPred'], []).append((i, conv))
+
+    def label(self, v: URIRef) -> str:
+        return self.labels.get(str(v)) or str(v)
+
+    def english(self, kvs: Dict[Node, Node]) -> str:
+        matches = []
+        for kvPos, (k, v) in enumerate(kvs.items()):
+            for convPos, conv in self.byPred.get(k, []):
                 if not conv['reportObj'] or v == conv['reportObj']:
-                    if conv['prepend']:
-                        words.append(conv['prepend'])
-                    if conv['label']:
-                        words.append(conv['label'])
-                    else:
-                        if isinstance(v, URIRef):
-                            lab = g.label(v)
-                            if lab:
-                                words.append(lab)
-                            else:
-                                words.append(str(v))
-                        else:
-                            words.append(v)
-    # also note here what kv weren't used
-
-    return ' '.join(words)
+                    matches.append((convPos, kvPos, conv, v))
+        # same word order as walking every conv, then every kv
+        matches.sort(key=lambda m: m[:2])
+
+        words = []
+        for _, _, conv, v in matches:
+            if conv['prepend']:
+                words.append(conv['prepend'])
+            if conv['label']:
+                words.append(conv['label'])
+            else:
+                if isinstance(v, URIRef):
+                    words.append(self.label(v))
+                else:
+                    words.append(v)
+        # also note here what kv weren't used
+
+        return ' '.join(words)
+
+
+def englishInput(conversions: NaturalInputConversions,
+                 kvs: Dict[Node, Node]) -> str:
+    return conversions.english(kvs)
 
 
 # maybe this should be json-ld
@@ -3,6 +3,7 @@ from invoke import task  # pytype: disable=import-error
 JOB = 'diarybot'
 PORT = 9048
 TAG = f'bang6:5000/{JOB}_x86:latest'
+JOURNAL = f'-v {JOB}_journal:/journal'  # unflushed saves; see Dockerfile
 
 @task
 def build_image(ctx):
@@ -15,11 +16,11 @@ def push_image(ctx):
 
 @task(pre=[build_image])
 def shell(ctx):
-    ctx.run(f'docker run --name={JOB}_shell --rm -it --cap-add SYS_PTRACE -v `pwd`:/opt --net=host {TAG} /bin/bash', pty=True)
+    ctx.run(f'docker run --name={JOB}_shell --rm -it --cap-add SYS_PTRACE -v `pwd`:/opt {JOURNAL} --net=host {TAG} /bin/bash', pty=True)
 
 @task(pre=[build_image])
 def local_run(ctx):
-    ctx.run(f'docker run --name={JOB}_local --rm -it --net=host -v `pwd`:/opt {TAG} '
+    ctx.run(f'docker run --name={JOB}_local --rm -it --net=host -v `pwd`:/opt {JOURNAL} {TAG} '
             f'python3 diarybot2.py -v --no-chat --drew-bot',
             pty=True, echo=True)
 
@@ -44,3 +45,11 @@ def backup(ctx, outdir='backup'):
     outPrefix = os.path.join(outdir, datetime.date.today().isoformat() + '_')
     for coll in colls:
         ctx.run(f'mongoexport --host=bang --db=diarybot --collection={coll} --out={outPrefix}{coll}.json')
+
+@task(pre=[build_image])
+def backfill_events(ctx):
+    ctx.run(f'docker run --name={JOB}_backfill --rm --net=host -v `pwd`:/opt {TAG} python3 backfillEvents.py', pty=True)
+
+@task(pre=[build_image])
+def rebuild_rollups(ctx):
+    ctx.run(f'docker run --name={JOB}_rollups --rm --net=host -v `pwd`:/opt {TAG} python3 rollups.py', pty=True)